@@ -0,0 +1,135 @@
+import os
+import re
+import gzip
+import time
+import hashlib
+import tempfile
+import threading
+from flask import request, send_file
+from ImageFormat import MIMETYPES
+
+# the mimetype of every kind of artifact
+ARTIFACT_MIMETYPES = dict(MIMETYPES, html='text/html', json='application/json',
+                          js='application/javascript')
+# artifact names are the hash of their content and an extension, nothing else is ever served
+ARTIFACT_NAME = re.compile(r'^[0-9a-f]{32}\.[a-z]+$')
+
+
+class ArtifactStore(object):
+
+    def __init__(self, root=None, max_age=None, prune_interval=3600):
+        # the directory shared by every worker of the node, it survives restarts
+        self.root = root or os.environ.get('ARTIFACT_DIR', os.path.join(tempfile.gettempdir(), 'eq-artifacts'))
+        os.makedirs(os.path.join(self.root, 'refs'), exist_ok=True)
+        # the artifacts and the refs not used for max_age seconds are deleted, every worker looks for them
+        # at most once every prune_interval seconds
+        self.max_age = max_age or int(os.environ.get('ARTIFACT_MAX_AGE', 30 * 86400))
+        self.prune_interval = prune_interval
+        self.pruned = 0
+        self.lock = threading.Lock()
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    # Write an artifact named by the hash of its content and return its name. A ref gives the
+    # artifact a stable key so that other workers can find it without producing it again,
+    # compress keeps a gzip copy next to it for the clients accepting gzip
+    def put(self, data, ext, ref=None, compress=False):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with self.lock:
+            due = time.time() - self.pruned > self.prune_interval
+            if due:
+                self.pruned = time.time()
+        if due:
+            self.prune()
+        name = hashlib.sha256(data).hexdigest()[:32] + '.' + ext
+        self.write(name, data)
+        if compress:
+            self.write(name + '.gz', gzip.compress(data, 9))
+        if ref is not None:
+            self.write(os.path.join('refs', self.ref_name(ref)), name.encode('ascii'), overwrite=True)
+        return name
+
+    # The name of the artifact stored under a ref, None when there is none
+    def lookup(self, ref):
+        try:
+            with open(self.path(os.path.join('refs', self.ref_name(ref))), 'rb') as f:
+                name = f.read().decode('ascii')
+        except OSError:
+            return None
+        self.touch(os.path.join('refs', self.ref_name(ref)))
+        return name if self.touch(name) else None
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as f:
+            return f.read()
+
+    # Serve an artifact straight from its file, the wsgi server sends it with sendfile. The response is
+    # cached for good unless max_age is given, which the urls that are not content-addressed need.
+    # Returns None when the artifact does not exist
+    def send(self, name, max_age=None):
+        if not ARTIFACT_NAME.match(name) or not self.touch(name):
+            return None
+        mimetype = ARTIFACT_MIMETYPES.get(name.rsplit('.', 1)[1], 'application/octet-stream')
+        compressed = self.path(name + '.gz')
+        if 'gzip' in request.headers.get('Accept-Encoding', '') and os.path.exists(compressed):
+            response = send_file(compressed, mimetype=mimetype, max_age=31536000, conditional=True)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = send_file(self.path(name), mimetype=mimetype, max_age=31536000, conditional=True)
+        if max_age is None:
+            # the content of a name never changes
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else:
+            # the etag of send_file lets the clients revalidate once it expires
+            response.headers['Cache-Control'] = f'public, max-age={max_age}'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+    # Mark a file as used now, False when it does not exist
+    def touch(self, name):
+        try:
+            os.utime(self.path(name))
+        except OSError:
+            return False
+        return True
+
+    # Delete the artifacts and the refs that were not put, looked up or sent for max_age seconds. A gzip copy
+    # goes with its artifact, and the files a killed worker left half written go too
+    def prune(self):
+        cutoff = time.time() - self.max_age
+        for directory in (self.root, self.path('refs')):
+            for entry in os.scandir(directory):
+                if not entry.is_file():
+                    continue
+                # a gzip copy is as old as its artifact
+                path = entry.path[:-len('.gz')] if entry.name.endswith('.gz') else entry.path
+                try:
+                    unused = os.path.getmtime(path) < cutoff
+                except OSError:
+                    # the artifact of the gzip copy or the file itself is gone already
+                    unused = True
+                if unused:
+                    self.remove(entry.path)
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def ref_name(ref):
+        return hashlib.sha256(ref.encode('utf-8')).hexdigest()
+
+    # Write a file atomically, readers in other workers never see a partial file
+    def write(self, name, data, overwrite=False):
+        path = self.path(name)
+        if not overwrite and self.touch(name):
+            return
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)
@@ -0,0 +1,172 @@
+import io
+import math
+import threading
+from collections import OrderedDict
+import numpy as np
+import seaborn as sns
+from PIL import Image
+
+
+# The lookup table turning a normalized value into the rgba color of the seaborn heatmaps
+def colormap_lut(name='rocket'):
+    cmap = sns.color_palette(name, as_cmap=True)
+    return (cmap(np.linspace(0, 1, 256)) * 255).astype(np.uint8)
+
+
+# Color a matrix of values with a lookup table, missing values stay transparent
+def colorize(values, vmin, vmax, lut):
+    missing = np.isnan(values)
+    scale = 255 / (vmax - vmin) if vmax > vmin else 0
+    index = np.clip((np.where(missing, vmin, values) - vmin) * scale, 0, 255).astype(np.uint8)
+    rgba = lut[index]
+    rgba[missing] = 0
+    return rgba
+
+
+# The smallest and largest values of a matrix and of a previous range
+def value_range(values, vmin=np.inf, vmax=-np.inf):
+    finite = values[~np.isnan(values)]
+    if len(finite) == 0:
+        return vmin, vmax
+    return min(vmin, finite.min()), max(vmax, finite.max())
+
+
+# Make room for length rows in a buffer, the capacity doubles so that appending stays cheap
+def grow(buffer, length):
+    if length <= len(buffer):
+        return buffer
+    grown = np.zeros((max(length, 2 * len(buffer)),) + buffer.shape[1:], dtype=buffer.dtype)
+    grown[:len(buffer)] = buffer
+    return grown
+
+
+def encode_png(rgba):
+    buf = io.BytesIO()
+    Image.fromarray(rgba, 'RGBA').save(buf, format='png')
+    return buf.getvalue()
+
+
+class TilePyramid(object):
+
+    # values is the date x hour matrix of one metric. In the tiles the dates run along x and
+    # the hours along y, at zoom z the whole matrix spans 2^z x 2^z tiles
+    def __init__(self, values, tile_size=256, cache_size=512):
+        values = np.asarray(values, dtype=float)
+        self.tile_size = tile_size
+        self.n_dates, self.n_hours = 0, values.shape[1]
+        # the color scale is shared by every tile of the pyramid
+        self.vmin, self.vmax = np.inf, -np.inf
+        self.lut = colormap_lut()
+        # level k holds the sums and counts of 2^k consecutive dates, the coarse tiles read from these rollups
+        self.sums, self.counts = [], []
+        # least recently used cache of the encoded tiles
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.append(values)
+
+    # Add new dates after the last one, only the tail of every rollup is recomputed
+    def append(self, values):
+        values = np.asarray(values, dtype=float)
+        with self.lock:
+            start, length = self.n_dates, self.n_dates + len(values)
+            self.n_dates = length
+            self.vmin, self.vmax = value_range(values, self.vmin, self.vmax)
+            level = 0
+            while True:
+                if level == len(self.sums):
+                    self.sums.append(np.zeros((0, self.n_hours)))
+                    self.counts.append(np.zeros((0, self.n_hours)))
+                self.sums[level] = grow(self.sums[level], length)
+                self.counts[level] = grow(self.counts[level], length)
+                if level == 0:
+                    self.sums[0][start:length] = np.nan_to_num(values)
+                    self.counts[0][start:length] = ~np.isnan(values)
+                else:
+                    # every entry adds up a pair of entries of the level below
+                    for rollup in (self.sums, self.counts):
+                        below = rollup[level - 1][2 * start:2 * length]
+                        if len(below) % 2:
+                            below = np.vstack([below, np.zeros((1, self.n_hours))])
+                        rollup[level][start:length] = below[0::2] + below[1::2]
+                if length == 1:
+                    break
+                start, length = start // 2, (length + 1) // 2
+                level += 1
+            # the position of every existing tile moves with the number of dates
+            self.cache.clear()
+
+    # zoom in until a single date is a few pixels wide
+    @property
+    def max_zoom(self):
+        return max(0, math.ceil(math.log2(max(self.n_dates, 1) / self.tile_size))) + 2
+
+    def tile(self, z, x, y):
+        if not 0 <= z <= self.max_zoom or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+            return None
+        with self.lock:
+            if (z, x, y) in self.cache:
+                self.cache.move_to_end((z, x, y))
+                return self.cache[(z, x, y)]
+            values = self.tile_values(z, x, y)
+        tile = encode_png(colorize(values, self.vmin, self.vmax, self.lut))
+        with self.lock:
+            self.cache[(z, x, y)] = tile
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return tile
+
+    # Sample the matrix under every pixel of a tile from the rollup closest to one date per pixel
+    def tile_values(self, z, x, y):
+        world = self.tile_size * 2 ** z
+        pixels = np.arange(self.tile_size) + 0.5
+        dates_per_pixel = self.n_dates / world
+        level = min(int(math.log2(dates_per_pixel)), len(self.sums) - 1) if dates_per_pixel >= 1 else 0
+        # the position of every pixel column on the dates of the rollup and of every pixel row on the hours
+        dates = np.floor((x * self.tile_size + pixels) * self.n_dates / world).astype(int) >> level
+        hours = np.floor((y * self.tile_size + pixels) * self.n_hours / world).astype(int)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sums[level][dates[None, :], hours[:, None]] / self.counts[level][dates[None, :], hours[:, None]]
+
+
+class IncrementalHeatmap(object):
+
+    # A date x hour heatmap drawn without matplotlib, kept as a matrix of colored pixels with one pixel per cell
+    def __init__(self, values, lut=None):
+        values = np.asarray(values, dtype=float)
+        self.lut = colormap_lut() if lut is None else lut
+        self.values = np.zeros((0, values.shape[1]))
+        self.pixels = np.zeros((0, values.shape[1], 4), dtype=np.uint8)
+        self.length = 0
+        self.vmin, self.vmax = np.inf, -np.inf
+        # the encoded images, keyed by their size and dropped at every append
+        self.encoded = dict()
+        self.lock = threading.Lock()
+        self.append(values)
+
+    # Add the rows of new dates, only their pixels are colored unless the color scale has to widen
+    def append(self, values):
+        values = np.asarray(values, dtype=float)
+        with self.lock:
+            start, end = self.length, self.length + len(values)
+            self.values = grow(self.values, end)
+            self.pixels = grow(self.pixels, end)
+            self.values[start:end] = values
+            vmin, vmax = value_range(values, self.vmin, self.vmax)
+            if (vmin, vmax) != (self.vmin, self.vmax):
+                # the color scale changed, re-colormap the kept values instead of recomputing them
+                self.vmin, self.vmax = vmin, vmax
+                start = 0
+            self.pixels[start:end] = colorize(self.values[start:end], self.vmin, self.vmax, self.lut)
+            self.length = end
+            self.encoded = dict()
+
+    # The heatmap scaled to the given size with nearest neighbour and encoded as png
+    def png(self, width, height):
+        with self.lock:
+            if (width, height) not in self.encoded:
+                image = Image.fromarray(self.pixels[:self.length], 'RGBA').resize((width, height), Image.NEAREST)
+                buf = io.BytesIO()
+                image.save(buf, format='png')
+                self.encoded[(width, height)] = buf.getvalue()
+            return self.encoded[(width, height)]
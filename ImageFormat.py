@@ -0,0 +1,67 @@
+import io
+from PIL import Image
+
+# the mimetype of every output format
+MIMETYPES = {'png': 'image/png',
+             'svg': 'image/svg+xml',
+             'webp': 'image/webp',
+             'jpeg': 'image/jpeg'}
+# other names accepted by the format query parameter
+ALIASES = {'jpg': 'jpeg', 'svg+xml': 'svg'}
+# the quality tiers, the dpi applies to every format, the encoder quality to the lossy ones and the zlib level
+# to png. The medium tier is the one busy renderers fall back to, its png is encoded the fastest
+QUALITIES = {'high': {'dpi': 100, 'quality': 90, 'compress_level': 6},
+             'medium': {'dpi': 80, 'quality': 75, 'compress_level': 1},
+             'low': {'dpi': 60, 'quality': 50, 'compress_level': 6}}
+
+
+# Pick the format and the quality tier of a figure for the current request.
+# The query parameters win, then the first of the preferred formats the browser draws. Every browser draws svg
+# in an img tag without listing it in Accept, the other formats have to be listed explicitly
+def negotiate(request, preferred):
+    fmt = request.args.get('format', '').lower()
+    fmt = ALIASES.get(fmt, fmt)
+    if fmt not in MIMETYPES:
+        accepted = [mimetype for mimetype, q in request.accept_mimetypes if q > 0]
+        fmt = next((f for f in preferred if f == 'svg' or MIMETYPES[f] in accepted), 'png')
+    quality = request.args.get('quality', '').lower()
+    if quality not in QUALITIES:
+        # clients asking to save data get the low tier unless they ask for another one
+        quality = 'low' if request.headers.get('Save-Data', '').lower() == 'on' else 'high'
+    return fmt, quality
+
+
+# Encode a figure in the given format and quality tier, or at an exact pixel width
+def save_figure(fig, fmt='png', quality='high', width=None):
+    tier = QUALITIES[quality]
+    dpi = width / fig.get_figwidth() if width else tier['dpi']
+    buf = io.BytesIO()
+    if fmt in ('jpeg', 'webp'):
+        fig.savefig(buf, format=fmt, dpi=dpi, pil_kwargs={'quality': tier['quality']})
+    else:
+        fig.savefig(buf, format=fmt, dpi=dpi)
+    return buf.getvalue()
+
+
+# Downscale an encoded raster image to a width and encode it in the given format and quality tier.
+# The reducing gap lets Pillow shrink by whole factors with a box filter first, which keeps it cheap, and the
+# tiers below high only use the box filter
+def resize_image(data, width, fmt='png', quality='high'):
+    image = Image.open(io.BytesIO(data))
+    if width < image.width:
+        size = (width, round(image.height * width / image.width))
+        if quality == 'high':
+            image = image.resize(size, Image.BILINEAR, reducing_gap=2.0)
+        else:
+            image = image.resize(size, Image.BOX)
+    if fmt == 'jpeg':
+        # jpeg has no alpha channel, flatten on the white background of the figures
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A') if image.mode == 'RGBA' else None)
+        image = background
+    buf = io.BytesIO()
+    if fmt in ('jpeg', 'webp'):
+        image.save(buf, format=fmt, quality=QUALITIES[quality]['quality'])
+    else:
+        image.save(buf, format=fmt, compress_level=QUALITIES[quality]['compress_level'])
+    return buf.getvalue()
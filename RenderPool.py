@@ -0,0 +1,98 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+# Runs once in every worker process before it takes any payload
+def warm_up_worker():
+    # load the non-interactive backend and build the font cache up front
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import font_manager
+    font_manager.findfont(font_manager.FontProperties(family=['sans-serif']))
+    # importing the ui components also imports seaborn, plotly and pandas
+    import UICOMPONENTS
+    # a dry-run render loads the colormaps and the text rendering path
+    UICOMPONENTS.render_daily({'columns': ['warm_up'], 'index': {'warm_up': [0, 1]}, 'values': {'warm_up': [0, 1]}})
+
+
+def ping():
+    return os.getpid()
+
+
+class RenderPool(object):
+
+    def __init__(self, max_workers=None):
+        # one worker for every core, rendering is cpu bound
+        self.max_workers = max_workers or os.cpu_count() or 1
+        # the number of renders submitted and not finished yet
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.executor = None
+        self.start()
+        # start all the workers now so that their warm up overlaps with the app start up
+        self.warming = [self.executor.submit(ping) for _ in range(self.max_workers)]
+
+    # Block until every worker has finished its warm up
+    def wait_until_warm(self):
+        return [future.result() for future in self.warming]
+
+    # Start the workers in place of the broken executor, unless another thread has replaced it already
+    def start(self, broken=None):
+        with self.lock:
+            if self.executor is not broken:
+                return
+            # spawn fresh interpreters instead of forking a process that already runs threads
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=warm_up_worker)
+        if broken is not None:
+            broken.shutdown(wait=False)
+
+    def submit(self, function, payload):
+        executor = self.executor
+        try:
+            future = executor.submit(function, payload)
+        except BrokenProcessPool:
+            # a worker that died breaks its executor for good, the render goes to a new one
+            self.start(executor)
+            future = self.executor.submit(function, payload)
+        with self.lock:
+            self.pending += 1
+        future.add_done_callback(self.finished)
+        return future
+
+    def finished(self, future):
+        with self.lock:
+            self.pending -= 1
+
+    def queue_depth(self):
+        return self.pending
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+# the quality tiers of the figures, from the best one to the cheapest one
+TIERS = ['full', 'reduced', 'fast', 'cached']
+
+
+class LoadMonitor(object):
+
+    def __init__(self, render_pool=None, thresholds=(1, 2, 4)):
+        self.render_pool = render_pool
+        # the pressure from which the reduced, fast and cached tiers apply
+        self.thresholds = thresholds
+
+    # The pressure on the renderers, 1 means as many pending renders or runnable processes as there are cores
+    def pressure(self):
+        cores = os.cpu_count() or 1
+        load = os.getloadavg()[0] / cores if hasattr(os, 'getloadavg') else 0
+        queue = self.render_pool.queue_depth() / self.render_pool.max_workers if self.render_pool else 0
+        return max(load, queue)
+
+    def tier(self):
+        pressure = self.pressure()
+        return TIERS[sum(pressure >= threshold for threshold in self.thresholds)]
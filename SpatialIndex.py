@@ -0,0 +1,190 @@
+import math
+import numpy as np
+
+# the mean radius of the earth
+EARTH_RADIUS_KM = 6371.0088
+# the latitudes web mercator reaches
+MERCATOR_LAT = 85.05112878
+
+
+# Read a bounding box given as minLon,minLat,maxLon,maxLat, raises ValueError when it is not one
+def parse_bbox(text):
+    bbox = [float(value) for value in text.split(',')]
+    if len(bbox) != 4 or not all(math.isfinite(value) for value in bbox):
+        raise ValueError(f'{text} is not a bounding box')
+    if bbox[1] > bbox[3]:
+        raise ValueError(f'{text} has its southern edge above its northern edge')
+    return tuple(bbox)
+
+
+# Read a point given as a lat and a lon, raises ValueError when it is not one
+def parse_point(lat, lon):
+    lat, lon = float(lat), float(lon)
+    if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+        raise ValueError(f'{lat},{lon} is not a point on the earth')
+    return lat, lon
+
+
+# The great-circle distances in km between a point and arrays of points
+def haversine(lat, lon, lats, lons):
+    lat, lon = math.radians(lat), math.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+# Project points on the unit square of web mercator, x runs east and y runs south
+def mercator(lat, lon):
+    sin = np.sin(np.radians(np.clip(lat, -MERCATOR_LAT, MERCATOR_LAT)))
+    return (np.asarray(lon) + 180) / 360, 0.5 - np.log((1 + sin) / (1 - sin)) / (4 * math.pi)
+
+
+def inverse_mercator(x, y):
+    return np.degrees(np.arctan(np.sinh(math.pi * (1 - 2 * np.asarray(y))))), np.asarray(x) * 360 - 180
+
+
+class GridIndex(object):
+
+    # A uniform grid of cells of cell_size degrees over points given by their lat and lon. The points are
+    # sorted by cell, so that the points of a run of cells along a row are one slice of the order
+    def __init__(self, lat, lon, cell_size=None):
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        valid = ~(np.isnan(self.lat) | np.isnan(self.lon))
+        if valid.any():
+            self.lat0, self.lon0 = self.lat[valid].min(), self.lon[valid].min()
+            height, width = self.lat[valid].max() - self.lat0, self.lon[valid].max() - self.lon0
+        else:
+            self.lat0, self.lon0, height, width = 0.0, 0.0, 0.0, 0.0
+        # without a cell size the cells hold a few points on average
+        if cell_size is None:
+            cell_size = math.sqrt(height * width * 4 / max(valid.sum(), 1)) or max(height, width, 1.0)
+        self.cell_size = cell_size
+        self.rows = int(height // cell_size) + 1
+        self.columns = int(width // cell_size) + 1
+        # the points without coordinates fall in a cell after the last one and never match
+        cells = np.full(len(self.lat), self.rows * self.columns)
+        cells[valid] = self.cell_rows(self.lat[valid]) * self.columns + self.cell_columns(self.lon[valid])
+        self.order = np.argsort(cells, kind='stable')
+        # the points of cell k are order[starts[k]:starts[k + 1]]
+        self.starts = np.searchsorted(cells[self.order], np.arange(self.rows * self.columns + 1))
+
+    def __len__(self):
+        return len(self.lat)
+
+    def cell_rows(self, lat):
+        return np.clip(((np.asarray(lat) - self.lat0) // self.cell_size).astype(int), 0, self.rows - 1)
+
+    def cell_columns(self, lon):
+        return np.clip(((np.asarray(lon) - self.lon0) // self.cell_size).astype(int), 0, self.columns - 1)
+
+    # The positions of the points in the cells of rows first_row to last_row and columns first_column to
+    # last_column, one slice per row
+    def cells(self, first_row, last_row, first_column, last_column):
+        slices = [self.order[self.starts[row * self.columns + first_column]:self.starts[row * self.columns + last_column + 1]]
+                  for row in range(first_row, last_row + 1)]
+        return np.concatenate(slices) if slices else np.zeros(0, dtype=int)
+
+    # The positions of the points inside a bounding box, in the order they were given. A box whose
+    # western edge is east of its eastern edge crosses the antimeridian
+    def query(self, min_lon, min_lat, max_lon, max_lat):
+        if min_lon > max_lon:
+            return np.union1d(self.box(min_lon, min_lat, 180.0, max_lat), self.box(-180.0, min_lat, max_lon, max_lat))
+        return self.box(min_lon, min_lat, max_lon, max_lat)
+
+    def box(self, min_lon, min_lat, max_lon, max_lat):
+        if len(self.lat) == 0 or max_lat < self.lat0 or max_lon < self.lon0 or min_lon > max_lon:
+            return np.zeros(0, dtype=int)
+        rows = self.cell_rows([min_lat, max_lat])
+        columns = self.cell_columns([min_lon, max_lon])
+        candidates = self.cells(rows[0], rows[1], columns[0], columns[1])
+        # the cells on the edges of the box are only partly inside it
+        lat, lon = self.lat[candidates], self.lon[candidates]
+        inside = (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+        return np.sort(candidates[inside])
+
+    # The positions of the points within radius_km of a point and their distances, from the closest one.
+    # Only the points in the bounding box of the circle are measured
+    def within(self, lat, lon, radius_km):
+        angle = radius_km / EARTH_RADIUS_KM
+        min_lat, max_lat = lat - math.degrees(angle), lat + math.degrees(angle)
+        if min_lat <= -90 or max_lat >= 90 or angle >= math.pi / 2 - abs(math.radians(lat)):
+            # the circle holds a pole, it spans every longitude
+            candidates = self.query(-180.0, max(min_lat, -90.0), 180.0, min(max_lat, 90.0))
+        else:
+            spread = math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(lat))))
+            # a box running over the antimeridian wraps around to the other side
+            min_lon = (lon - spread + 180) % 360 - 180
+            max_lon = (lon + spread + 180) % 360 - 180
+            candidates = self.query(min_lon, min_lat, max_lon, max_lat)
+        distances = haversine(lat, lon, self.lat[candidates], self.lon[candidates])
+        inside = distances <= radius_km
+        order = np.argsort(distances[inside], kind='stable')
+        return candidates[inside][order], distances[inside][order]
+
+    # The positions of the k points closest to a point and their distances, from the closest one. The search
+    # circle starts at the size of a cell and doubles until it holds k points
+    def nearest(self, lat, lon, k):
+        radius_km = max(math.radians(self.cell_size) * EARTH_RADIUS_KM, 1.0)
+        while True:
+            positions, distances = self.within(lat, lon, radius_km)
+            # half of the circumference reaches every point of the earth
+            if len(positions) >= k or radius_km >= math.pi * EARTH_RADIUS_KM:
+                return positions[:k], distances[:k]
+            radius_km *= 2
+
+
+class ClusterIndex(object):
+
+    # Cluster points for every zoom level from max_zoom down to 0. The clusters of a zoom are the clusters of
+    # the zoom above merged on a grid of cells radius pixels wide in tiles of extent pixels, and they carry
+    # the number of their points, the sums of the weights of their points and the position of one of them.
+    # The level above max_zoom holds the points themselves
+    def __init__(self, lat, lon, weights=None, radius=40, extent=256, max_zoom=16):
+        lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+        valid = ~(np.isnan(lat) | np.isnan(lon))
+        self.max_zoom = max_zoom
+        x, y = mercator(lat[valid], lon[valid])
+        level = {'x': x, 'y': y, 'count': np.ones(len(x)), 'point': np.nonzero(valid)[0],
+                 'sums': dict((name, np.nan_to_num(np.asarray(values, dtype=float)[valid]))
+                              for name, values in (weights or dict()).items())}
+        self.levels = [None] * (max_zoom + 2)
+        self.levels[max_zoom + 1] = level
+        # parents[z][i] is the cluster of zoom z merging the cluster i of the zoom above
+        self.parents = [None] * (max_zoom + 1)
+        for zoom in range(max_zoom, -1, -1):
+            cell = radius / (extent * 2 ** zoom)
+            columns = int(1 / cell) + 1
+            keys = np.floor(level['y'] / cell).astype(np.int64) * columns + np.floor(level['x'] / cell).astype(np.int64)
+            _, parent = np.unique(keys, return_inverse=True)
+            size = parent.max() + 1 if len(parent) else 0
+            count = np.bincount(parent, weights=level['count'], minlength=size)
+            point = np.full(size, len(lat))
+            np.minimum.at(point, parent, level['point'])
+            # the clusters sit at the centroid of their points
+            level = {'x': np.bincount(parent, weights=level['x'] * level['count'], minlength=size) / np.maximum(count, 1),
+                     'y': np.bincount(parent, weights=level['y'] * level['count'], minlength=size) / np.maximum(count, 1),
+                     'count': count, 'point': point,
+                     'sums': dict((name, np.bincount(parent, weights=values, minlength=size))
+                                  for name, values in level['sums'].items())}
+            self.parents[zoom] = parent
+            self.levels[zoom] = level
+        for level in self.levels:
+            level['lat'], level['lon'] = inverse_mercator(level['x'], level['y'])
+            level['index'] = GridIndex(level['lat'], level['lon'])
+
+    # The level of the clusters drawn at a zoom and the positions of its clusters inside a bounding box
+    def clusters(self, zoom, bbox=None):
+        level = self.levels[min(max(int(zoom), 0), self.max_zoom + 1)]
+        if bbox is None:
+            return level, np.arange(len(level['count']))
+        return level, level['index'].query(*bbox)
+
+    # The level of the clusters drawn at a zoom and the positions of its clusters holding a point inside a
+    # bounding box. The centroid of such a cluster can lie outside the box at the coarse zooms
+    def containing(self, zoom, bbox):
+        zoom = min(max(int(zoom), 0), self.max_zoom + 1)
+        positions = self.levels[self.max_zoom + 1]['index'].query(*bbox)
+        for parents in self.parents[self.max_zoom:zoom - 1 if zoom else None:-1]:
+            positions = np.unique(parents[positions])
+        return self.levels[zoom], positions
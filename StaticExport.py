@@ -0,0 +1,77 @@
+import os
+import sys
+import hashlib
+import argparse
+import plotly.offline as opy
+from UICOMPONENTS import SIZES
+from ImageFormat import resize_image
+
+
+# Write an asset named by the hash of its content, returns its path relative to the site
+def write_asset(output, data, ext):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    name = 'assets/' + hashlib.sha256(data).hexdigest()[:16] + '.' + ext
+    path = os.path.join(output, name)
+    if not os.path.exists(path):
+        with open(path, 'wb') as f:
+            f.write(data)
+    return name
+
+
+# The html of a figure view, vector figures are written once and raster ones in every size variant
+def figure_html(figure, name, output):
+    view = figure.views[name]
+    if view['preferred'][0] == 'svg':
+        data = figure.render(view['function'], dict(view['payload'], format='svg')).result()
+        return f"<img src='{write_asset(output, data, 'svg')}' width='1100' style='max-width:100%;height:auto'/>"
+    master = figure.master(name).result()
+    paths = dict((width, write_asset(output, resize_image(master, width, 'png', 'high'), 'png'))
+                 for width in sorted(SIZES.values()))
+    srcset = ", ".join(f"{path} {width}w" for width, path in paths.items())
+    return (f"<img src='{paths[SIZES['desktop']]}' srcset='{srcset}' sizes='(max-width: 1100px) 100vw, 1100px' "
+            f"width='1100' style='max-width:100%;height:auto'/>")
+
+
+def export(app, output):
+    os.makedirs(os.path.join(output, 'assets'), exist_ok=True)
+    sections = []
+    for name in app.figure.views:
+        sections.append(f"<section><h2>{name.replace('_', ' ')}</h2>{figure_html(app.figure, name, output)}</section>")
+    # the map is a page of its own so that the dashboard itself stays small, plotly.js sits next to it
+    plotlyjs = os.path.basename(write_asset(output, opy.get_plotlyjs(), 'js'))
+    poi_map = write_asset(output, f"<!DOCTYPE html><html><head><meta charset='utf-8'></head>"
+                                  f"<body style='margin:0'>{app.geo.geo_plot(app.poi, app.events_hourly, plotlyjs)}"
+                                  f"</body></html>", 'html')
+    sections.append(f"<section><h2>poi</h2><iframe src='{poi_map}' width='100%' height='620' "
+                    f"style='border:0'></iframe></section>")
+    with open(os.path.join(output, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write("<!DOCTYPE html><html><head><meta charset='utf-8'>"
+                "<meta name='viewport' content='width=device-width, initial-scale=1'>"
+                "<title>EQ Works dashboard</title></head><body>")
+        f.write("".join(sections))
+        f.write("</body></html>")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render every figure and the poi map into a static site')
+    parser.add_argument('output', nargs='?', default='site', help='the directory the site is written to')
+    parser.add_argument('--timeout', type=float, default=600, help='the seconds to wait for the app to warm up')
+    args = parser.parse_args(argv)
+    # importing the app loads every data source and renders every figure
+    import app
+    try:
+        if not app.ready.wait(args.timeout):
+            print(f"the app did not warm up within {args.timeout:g}s", file=sys.stderr)
+            return 1
+        if app.warm_up_error is not None:
+            print(f"the app failed to warm up: {app.warm_up_error!r}", file=sys.stderr)
+            return 1
+        export(app, args.output)
+    finally:
+        app.render_pool.shutdown()
+    print(f"dashboard written to {os.path.join(args.output, 'index.html')}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,124 +1,823 @@
 import pandas as pd
+import numpy as np
 import seaborn as sns
+import plotly
 import plotly.express as px
-import io
-import matplotlib.pyplot as plt
+import plotly.graph_objects as go
+import inspect
 import datetime
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
 from matplotlib.figure import Figure
 import base64
+import hashlib
 import json
 import plotly.offline as opy
+from plotly.utils import PlotlyJSONEncoder
+from flask import request
+from ImageFormat import MIMETYPES, negotiate, save_figure, resize_image
+from HeatmapTiles import TilePyramid, IncrementalHeatmap
+from RenderPool import LoadMonitor
+from SpatialIndex import GridIndex, ClusterIndex
+from VectorTiles import VectorTileSet
+
+
+# the pixel width of the daily figure, each line chart gets an equal share of it
+DAILY_WIDTH = 1200
+# the pixel size of the hourly figure, the heatmaps share its height
+HOURLY_WIDTH = 1000
+HOURLY_HEIGHT = 650
+# the widths every raster figure is offered at through srcset, all of them are downscaled from a
+# single render at the largest width
+SIZES = {'thumbnail': 320, 'mobile': 640, 'desktop': 1100, 'retina': 2200}
+
+# the dictionary hosting the reusable figures of this process, keyed by the layout of the plot. The least
+# recently used layouts are dropped beyond templates_size, every date count and facet shape is a layout
+templates = OrderedDict()
+templates_size = 16
+templates_lock = threading.Lock()
+
+
+# Get the template for a layout, every template carries its own lock so that
+# threaded workers never draw on the same figure at the same time
+def get_template(layout):
+    with templates_lock:
+        if layout in templates:
+            templates.move_to_end(layout)
+        else:
+            templates[layout] = {'lock': threading.Lock(), 'figure': None, 'axes': None}
+            if len(templates) > templates_size:
+                templates.popitem(last=False)
+        return templates[layout]
+
+
+# Render the line charts of a daily payload and return the encoded image
+def render_daily(payload):
+    columns = payload['columns']
+    template = get_template(('daily', tuple(columns)))
+    with template['lock']:
+        if template['figure'] is None:
+            # Construct the plot
+            fig = Figure()
+            axe = fig.subplots(1, len(columns),
+                               squeeze=False)
+            y = 0
+            # Use looping to plot all the graphs
+            for column in columns:
+                index = pd.Index(payload['index'][column], name='date')
+                pd.Series(payload['values'][column], index=index).plot(ax=axe[0, y], figsize=(DAILY_WIDTH / 100, 6))
+                axe[0, y].set_title(column)
+                y += 1
+            template['figure'], template['axes'] = fig, axe
+        else:
+            # Refresh the lines of the existing figure in place
+            fig, axe = template['figure'], template['axes']
+            y = 0
+            for column in columns:
+                axe[0, y].lines[0].set_data(payload['index'][column], payload['values'][column])
+                axe[0, y].relim()
+                axe[0, y].autoscale_view()
+                y += 1
+        return save_figure(fig, payload.get('format', 'png'), payload.get('quality', 'high'), payload.get('width'))
+
+
+# Render the heatmaps of an hourly payload and return the encoded image
+def render_hourly(payload):
+    columns = payload['columns']
+    # the optional pixel size, title prefix and color limits of every heatmap, used by the small multiples
+    size = payload.get('size', (HOURLY_WIDTH, HOURLY_HEIGHT))
+    title = payload.get('title', '')
+    clim = payload.get('clim', dict())
+    # the heatmap meshes can only be refreshed in place when the shape of every pivot is unchanged
+    layout = ('hourly', size) + tuple((column,) + payload['values'][column].shape for column in columns)
+    template = get_template(layout)
+    with template['lock']:
+        if template['figure'] is None:
+            # set up the subplot object for accommodating heatmaps
+            x = 0
+            fig = Figure(figsize=(size[0] / 100, size[1] / 100), constrained_layout=True)
+            axe = fig.subplots(len(columns), 1,
+                               squeeze=False)
+            # fig.tight_layout()
+            # using loop to plot all the heatmaps
+            for column in columns:
+                frame = pd.DataFrame(payload['values'][column],
+                                     index=pd.Index(payload['rows'], name='date'),
+                                     columns=pd.Index(payload['hours'][column], name='hour'))
+                vmin, vmax = clim.get(column, (None, None))
+                sns.heatmap(frame, ax=axe[x, 0], vmin=vmin, vmax=vmax)
+                axe[x, 0].set_title(title + column)
+                x += 1
+            template['figure'], template['axes'] = fig, axe
+        else:
+            # Refresh the meshes and the tick labels of the existing figure in place
+            fig, axe = template['figure'], template['axes']
+            x = 0
+            for column in columns:
+                values = np.ma.masked_invalid(payload['values'][column])
+                mesh = axe[x, 0].collections[0]
+                mesh.set_array(values)
+                mesh.set_clim(*clim.get(column, (values.min(), values.max())))
+                axe[x, 0].set_title(title + column)
+                rows = (axe[x, 0].get_yticks() - 0.5).astype(int)
+                cols = (axe[x, 0].get_xticks() - 0.5).astype(int)
+                axe[x, 0].set_yticklabels([payload['rows'][i] for i in rows])
+                axe[x, 0].set_xticklabels([payload['hours'][column][i] for i in cols])
+                x += 1
+        return save_figure(fig, payload.get('format', 'png'), payload.get('quality', 'high'), payload.get('width'))
+
+
+# the version of the rendering code, the rendered images kept on disk are keyed by it so that a deploy
+# changing how figures are drawn or encoded does not serve the images of the previous code
+RENDER_VERSION = hashlib.sha1("".join(inspect.getsource(f) for f in (render_daily, render_hourly, save_figure, resize_image))
+                              .encode('utf-8')).hexdigest()[:12]
+
+
+# Largest-Triangle-Three-Buckets downsampling, returns the positions of the points to keep.
+# The first and last points are always kept, every bucket in between keeps the point forming
+# the largest triangle with the point kept before it and the average of the next bucket
+def lttb(x, y, threshold):
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # split the inner points into threshold - 2 buckets of nearly equal size
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    counts = np.diff(edges)
+    average_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    average_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+    # the third vertex of every bucket is the average of the next one, the last point for the last bucket
+    next_x = np.append(average_x[1:], x[-1])
+    next_y = np.append(average_y[1:], y[-1])
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs((x[a] - next_x[i]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y[i] - y[a]))
+        a = lo + np.argmax(np.nan_to_num(area, nan=-1.0))
+        selected[i + 1] = a
+    return selected
+
+
+# Aggregate (row, column, value) triples straight into a grid of at most height x width cells.
+# Every cell holds the mean of the values falling in it, the cost depends on the output size and
+# not on the number of rows and columns of the data. Also returns the first row and column of every cell
+def bin_grid(rows, n_rows, columns, n_columns, values, height, width):
+    height, width = min(n_rows, height), min(n_columns, width)
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    cells = (rows[valid] * height // n_rows) * width + columns[valid] * width // n_columns
+    sums = np.bincount(cells, weights=values[valid], minlength=height * width)
+    counts = np.bincount(cells, minlength=height * width)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        grid = (sums / counts).reshape(height, width)
+    first_rows = np.unique(np.arange(n_rows) * height // n_rows, return_index=True)[1]
+    first_columns = np.unique(np.arange(n_columns) * width // n_columns, return_index=True)[1]
+    return grid, first_rows, first_columns
+
+
+# Turn an array into a short json list, missing values become null and whole numbers drop their decimals
+def compact_values(values):
+    values = np.asarray(values, dtype=float)
+    finite = values[~np.isnan(values)]
+    if len(finite) and np.all(finite == np.round(finite)):
+        return [None if np.isnan(v) else int(v) for v in values.tolist()]
+    return [None if np.isnan(v) else v for v in np.round(values, 4).tolist()]
+
+
+# coordinates are packed as fixed-point integers of a millionth of a degree, about 11 cm at the equator
+COORDINATE_SCALE = 1000000
+
+
+# the typed arrays whole numbers are packed in, from the smallest one
+PACKED_INTEGERS = [('int8', '<i1'), ('int16', '<i2'), ('int32', '<i4')]
+
+
+# Pack a numeric array as the base64 of its little-endian bytes, the browser reads it as a typed array.
+# Whole numbers are packed in the smallest integer type holding them and the others as float64, a scale
+# turns the values into fixed-point integers first. Arrays that are not numeric, and short arrays whose
+# envelope would outweigh the saving, are returned as they are
+def pack_array(values, scale=None):
+    values = np.asarray(values)
+    if values.dtype.kind not in 'biuf' or len(values) < 16:
+        return values
+    values = values.astype(float)
+    if scale is not None:
+        values = np.round(values * scale)
+    packed = {'dtype': 'float64', 'data': values.astype('<f8')}
+    if not np.isnan(values).any() and np.all(values == np.round(values)):
+        for dtype, code in PACKED_INTEGERS:
+            limits = np.iinfo(code)
+            if len(values) == 0 or (values.min() >= limits.min and values.max() <= limits.max):
+                packed = {'dtype': dtype, 'data': values.astype(code)}
+                break
+    packed['data'] = base64.b64encode(packed['data'].tobytes()).decode('ascii')
+    if scale is not None:
+        packed['scale'] = scale
+    return packed
+
+
+# The chart specification of a daily payload, drawn in the browser by static/eqchart.js
+def daily_spec(payload):
+    return {'type': 'line',
+            'width': DAILY_WIDTH,
+            'height': 600,
+            'x': {'label': 'date'},
+            'series': [{'name': column,
+                        'x': compact_values(payload['index'][column]),
+                        'values': compact_values(payload['values'][column])}
+                       for column in payload['columns']]}
+
+
+# The chart specification of an hourly payload, every panel is a row-major date x hour matrix
+def hourly_spec(payload):
+    panels = []
+    for column in payload['columns']:
+        values = payload['values'][column]
+        panels.append({'name': column,
+                       'columns': compact_values(payload['hours'][column]),
+                       'values': compact_values(values.ravel()),
+                       'min': compact_values([np.nanmin(values)])[0],
+                       'max': compact_values([np.nanmax(values)])[0]})
+    return {'type': 'heatmap',
+            'width': HOURLY_WIDTH,
+            'height': HOURLY_HEIGHT,
+            'rows': {'label': 'date', 'values': list(payload['rows'])},
+            'columnLabel': 'hour',
+            'colorscale': sns.color_palette('rocket', 16).as_hex(),
+            'panels': panels}
 
 
 class DataVisualization:
 
-    def __init__(self):
+    def __init__(self, render_pool=None, artifact_store=None):
         # the dictionary hosting all the data frames from the api server
         self.matrix = dict()
+        # the pool rendering the figures in worker processes, figures are rendered inline without it
+        self.render_pool = render_pool
+        # the on-disk store the encoded images and json bodies are served from, they stay in memory without it
+        self.artifact_store = artifact_store
+        # the monitor picking the quality tier of every figure from the render queue and the cpu load
+        self.load_monitor = LoadMonitor(render_pool)
+        # the state of every figure view, keyed by the name of its route
+        self.views = dict()
+        # the tile pyramids and the pure-array heatmaps of the hourly routes, keyed by metric
+        self.tiles = dict()
+        self.heatmaps = dict()
+        # the metrics and the dates of every hourly route drawn by the pure-array path
+        self.array_metrics = dict()
+        self.array_dates = dict()
+        # the prefix of the route serving the size variants of the figures
+        self.figure_url = '/figures'
+        # the prefix of the route serving the artifacts of the store
+        self.artifact_url = '/artifacts'
+        # the prefix of the static files, the views are also built outside of the requests
+        self.static_url = '/static'
+        # the payloads of the per poi small multiples keyed by route, and their images keyed by digest and variant
+        # in a least recently used cache, the images of the pois whose data changed fall out of it
+        self.facets = dict()
+        self.facet_images = OrderedDict()
+        self.facet_cache_size = 256
+        self.facet_lock = threading.Lock()
+        # the lock of every source, its data is loaded, appended and drawn again by one thread at a time
+        self.source_locks = dict()
+        self.source_locks_lock = threading.Lock()
+
+    # The lock of a source, reentrant so that loading a source can append to it and draw it again
+    def source_lock(self, name):
+        with self.source_locks_lock:
+            return self.source_locks.setdefault(name, threading.RLock())
 
     def add_data_for_visualization(self, source):
         # Execute the source function and transform its return into a dataframe
-        response = source()
-        dataframe = pd.DataFrame(json.loads(response.get_data().decode("utf-8")))
-        # save the dataframe into general matrix that stores every dataframe
-        self.matrix[source.__name__] = dataframe
+        self.load_response(source.__name__, source())
         return source
 
-    # This method should plot the data obtained under "daily" route
-    def daily_data_plot(self, source):
-        df = self.matrix[source.__name__].drop('date', axis=1)
-        df.index.name = 'date'
-        # drop unnecessary poi column
-        if 'poi_id' in df.columns:
-            df = df.drop('poi_id', 1)
-        # Construct the plot
-        fig = Figure()
-        axe = fig.subplots(1, len(df.columns),
-                           squeeze=False)
-        y = 0
-        # Use looping to plot all the graphs
-        for column in df.columns:
-            df[column].plot(ax=axe[0, y], figsize=(12, 6))
-            axe[0, y].set_title(column)
-            y += 1
-        buf = io.BytesIO()
-        fig.savefig(buf, format="png")
-        # Embed the result in the html output.
-        data = base64.b64encode(buf.getbuffer()).decode("ascii")
+    # Load a response of the api server as the data of a source, and draw again what is drawn from it.
+    # Unchanged data keeps the current dataframe and everything drawn from it
+    def load_response(self, name, response):
+        dataframe = pd.DataFrame(json.loads(response.get_data().decode("utf-8")))
+        with self.source_lock(name):
+            if name in self.matrix and self.matrix[name].equals(dataframe):
+                return
+            # a response repeating the rows already loaded and adding new ones only appends the new rows
+            old = self.matrix.get(name)
+            if old is not None and len(dataframe.index) > len(old.index) and list(dataframe.columns) == list(old.columns) \
+                    and dataframe.iloc[:len(old.index)].equals(old):
+                self.append_hourly_data(name, dataframe.iloc[len(old.index):])
+                return
+            # save the dataframe into general matrix that stores every dataframe
+            self.matrix[name] = dataframe
+            if name in self.array_dates:
+                self.build_array_plot(name)
+            if name in self.views:
+                self.refresh_view(name)
 
-        def wraper():
-          return f"<img src='data:image/png;base64,{data}' width='1100'/>"
+    # Submit a payload to the render pool, the returned future holds the encoded image
+    def render(self, function, payload):
+        if self.render_pool is not None:
+            return self.render_pool.submit(function, payload)
+        future = Future()
+        future.set_result(function(payload))
+        return future
 
-        wraper.__name__ = source.__name__
-        return wraper
+    # Whether a render has failed, the failed renders are never served from a cache but submitted again
+    def failed(self, future):
+        return future.done() and not future.cancelled() and future.exception() is not None
 
+    # The future of the high resolution master of a view, rendered again when the last render failed
+    def master(self, name):
+        with self.source_lock(name):
+            view = self.views[name]
+            if self.failed(view['master']):
+                view['master'] = self.render(view['function'], dict(view['payload'], format='png', width=max(SIZES.values())))
+            return view['master']
 
-    def hour_data_plot(self, source):  # This method serves to plot all the hour-based data, and plot them in heatmap
+    # Build the compact payload of the line charts from the dataframe of a "daily" route
+    def daily_payload(self, name):
+        df = self.matrix[name].drop('date', axis=1)
+        # drop unnecessary poi column
+        if 'poi_id' in df.columns:
+            df = df.drop('poi_id', axis=1)
+        # keep about one point per horizontal pixel of every line chart so long histories stay cheap to draw
+        threshold = DAILY_WIDTH // max(len(df.columns), 1)
+        payload = {'columns': list(df.columns), 'index': dict(), 'values': dict()}
+        for column in df.columns:
+            selected = lttb(df.index.values, df[column].values, threshold)
+            payload['index'][column] = df.index.values[selected]
+            payload['values'][column] = df[column].values[selected]
+        return payload
+
+    # Build the compact payload of the heatmaps from the dataframe of an "hourly" route
+    def hourly_payload(self, name):
         # get the dataframe from self.matrix
-        df = self.matrix[source.__name__]
+        return self.hourly_frame_payload(self.matrix[name])
+
+    def hourly_frame_payload(self, df, width=HOURLY_WIDTH, height=HOURLY_HEIGHT):
         # drop unnecessary poi column
         if 'poi_id' in df.columns:
-            df = df.drop('poi_id', 1)
+            df = df.drop('poi_id', axis=1)
         # preserve the order of  date as the pivotal table in Pandas automatically sort the input
         index_list = [i for i in df.date.unique()]
-        # set the index of data frame as 'date' column
-        df = df.set_index('date')
+        hours = np.unique(df.hour.values)
+        # the position of every row on the date and hour axes of the heatmap
+        rows = pd.Index(index_list).get_indexer(df.date)
+        columns_position = np.searchsorted(hours, df.hour.values)
         # generate the column list which will be used to generate dataframe for all the dimension
-        columns = [i for i in df.columns if i != 'hour']
-        # construct a hash table to store different dataframe for every dimension
-        dataframe_dict = dict()
-        # using pivotal table to convert the dataframe into what i need to plot heatmap
-        for column in columns:
-            dataframe_dict[column] = pd.pivot_table(df[['hour', column]],
-                                                    index=['date'],
-                                                    columns=['hour'])
-            # re set the index based on the original order that has been preserved
-            dataframe_dict[column] = dataframe_dict[column].reindex(index_list)
-            dataframe_dict[column].columns = dataframe_dict[column].columns.droplevel()
-        # set up the subplot object for accommodating heatmaps
-
-        x = 0
-        fig, axe = plt.subplots(len(columns), 1,
-                                squeeze=False,
-                                figsize=(10, 6.5),
-                                constrained_layout=True)
-        # fig.tight_layout()
-        # using loop to plot all the heatmaps
+        columns = [i for i in df.columns if i not in ('date', 'hour')]
+        payload = {'columns': columns, 'rows': index_list, 'hours': dict(), 'values': dict(),
+                   'size': (width, height)}
+        # bin the rows straight into the pixels of every heatmap, each heatmap gets an equal share of the height
         for column in columns:
-            sns.heatmap(dataframe_dict[column], ax=axe[x, 0])
-            axe[x, 0].set_title(column)
-            x += 1
-        buf = io.BytesIO()
-        fig.savefig(buf, format="png")
-        # Embed the result in the html output.
-        data = base64.b64encode(buf.getbuffer()).decode("ascii")
+            grid, first_rows, first_columns = bin_grid(rows, len(index_list), columns_position, len(hours),
+                                                       df[column].values, height // max(len(columns), 1), width)
+            payload['rows'] = [index_list[i] for i in first_rows]
+            payload['hours'][column] = hours[first_columns].tolist()
+            payload['values'][column] = grid
+        return payload
+
+    # Bin the rows of an hourly dataframe into one full resolution date x hour matrix per metric
+    def hourly_grids(self, df, dates):
+        rows = pd.Index(dates).get_indexer(df.date)
+        hours = df.hour.values.astype(int)
+        grids = dict()
+        for column in df.columns:
+            if column not in ('date', 'hour', 'poi_id'):
+                grids[column] = bin_grid(rows, len(dates), hours, 24, df[column].values, len(dates), 24)[0]
+        return grids
+
+    # Build the pure-array heatmap and the deep-zoom tile pyramid of every metric of an "hourly" route
+    def hour_array_plot(self, source):
+        self.build_array_plot(source.__name__)
+        return source
+
+    def build_array_plot(self, name):
+        df = self.matrix[name]
+        dates = [i for i in df.date.unique()]
+        grids = self.hourly_grids(df, dates)
+        for column, grid in grids.items():
+            self.heatmaps[column] = IncrementalHeatmap(grid)
+            self.tiles[column] = TilePyramid(grid)
+        self.array_metrics[name] = list(grids)
+        self.array_dates[name] = dates
+
+    # Add the rows of new dates to an hourly route. The pure-array heatmaps and the tile pyramids only
+    # process the new dates, the matplotlib figures of the route are rebuilt when they are next requested
+    def append_hourly_data(self, name, rows):
+        new = pd.DataFrame(rows)
+        with self.source_lock(name):
+            self.matrix[name] = pd.concat([self.matrix[name], new], ignore_index=True)
+            if name in self.array_dates:
+                known = set(self.array_dates[name])
+                dates = [i for i in new.date.unique() if i not in known]
+                if len(dates) < new.date.nunique():
+                    # rows of dates already drawn change existing cells, draw the route again
+                    self.build_array_plot(name)
+                else:
+                    for column, grid in self.hourly_grids(new, dates).items():
+                        self.heatmaps[column].append(grid)
+                        self.tiles[column].append(grid)
+                    self.array_dates[name] = self.array_dates[name] + dates
+            if name in self.views:
+                self.refresh_view(name)
+
+    # The encoded png of a heatmap tile, None when the metric or the tile does not exist
+    def heatmap_tile(self, metric, z, x, y):
+        if metric not in self.tiles:
+            return None
+        return self.tiles[metric].tile(z, x, y)
+
+    # Build the payloads of the small multiples of an hourly route, one per poi. Every metric has one
+    # color scale shared by all the pois, and every facet carries a digest of what it draws
+    def facet_payloads(self, name):
+        df = self.matrix[name]
+        cached = self.facets.get(name)
+        if cached is not None and cached['data'] is df:
+            return cached['payloads']
+        payloads = dict()
+        for poi_id, frame in df.groupby('poi_id', sort=True):
+            payload = self.hourly_frame_payload(frame, HOURLY_WIDTH // 2, HOURLY_HEIGHT // 2)
+            payload['title'] = f'poi {poi_id} '
+            payloads[poi_id] = payload
+        columns = [c for c in df.columns if c not in ('date', 'hour', 'poi_id')]
+        clim = dict((column, (float(np.nanmin([np.nanmin(p['values'][column]) for p in payloads.values()])),
+                              float(np.nanmax([np.nanmax(p['values'][column]) for p in payloads.values()]))))
+                    for column in columns)
+        for payload in payloads.values():
+            payload['clim'] = clim
+            digest = hashlib.sha1(repr((payload['title'], payload['rows'], payload['hours'], clim)).encode())
+            for column in payload['columns']:
+                digest.update(payload['values'][column].tobytes())
+            payload['digest'] = digest.hexdigest()
+        self.facets[name] = {'data': df, 'payloads': payloads}
+        return payloads
+
+    # The html of the small multiples of an hourly route. The facets are submitted together so that
+    # they render in parallel, and each one is cached by its digest so a new poi leaves the others alone
+    def facet_view(self, name, key):
+        futures = []
+        with self.facet_lock:
+            for poi_id, payload in self.facet_payloads(name).items():
+                cache_key = (payload['digest'],) + key
+                if cache_key in self.facet_images and not self.failed(self.facet_images[cache_key]):
+                    self.facet_images.move_to_end(cache_key)
+                else:
+                    self.facet_images[cache_key] = self.render(render_hourly, dict(payload, format=key[0], quality=key[1]))
+                futures.append(self.facet_images[cache_key])
+            while len(self.facet_images) > self.facet_cache_size:
+                self.facet_images.popitem(last=False)
+        images = []
+        for future in futures:
+            data = base64.b64encode(future.result()).decode("ascii")
+            images.append(f"<img src='data:{MIMETYPES[key[0]]};base64,{data}' width='550'/>")
+        return "<div style='display:flex;flex-wrap:wrap'>" + "".join(images) + "</div>"
+
+    # The html of the pure-array heatmaps of an hourly route, one image per metric
+    def array_view(self, name):
+        metrics = self.array_metrics[name]
+        height = HOURLY_HEIGHT // max(len(metrics), 1)
+        images = []
+        for metric in metrics:
+            data = base64.b64encode(self.heatmaps[metric].png(HOURLY_WIDTH, height)).decode("ascii")
+            images.append(f"<img src='data:image/png;base64,{data}' alt='{metric}' width='1100'/>")
+        return "".join(images)
+
+    # Build the view of a figure, every format and quality variant is rendered once and cached.
+    # With ?render=client the view sends the chart specification instead and the browser draws it,
+    # with ?render=array an hourly view sends the heatmaps of the pure-array path
+    def figure_view(self, name, function, payload_function, preferred, spec_function):
+        self.views[name] = {'function': function, 'payload_function': payload_function,
+                            'preferred': preferred, 'spec_function': spec_function}
+        self.refresh_view(name)
 
         def wraper():
-            return f"<img src='data:image/png;base64,{data}' width='1100'/>"
+            view = self.views[name]
+            mode = request.args.get('render')
+            if mode == 'spec':
+                # the inlined specification is sent when its artifact has been pruned from the store
+                response = None if view['spec_artifact'] is None else self.artifact_store.send(view['spec_artifact'], max_age=300)
+                if response is not None:
+                    response.headers['X-Render-Quality'] = 'client'
+                    return response
+                return view['spec'], {'Content-Type': 'application/json', 'X-Render-Quality': 'client'}
+            if mode == 'client':
+                return self.client_html(view), {'X-Render-Quality': 'client'}
+            if mode == 'array' and name in self.array_metrics:
+                return self.array_view(name), {'X-Render-Quality': 'fast'}
+            key = negotiate(request, view['preferred'])
+            facet = request.args.get('facet') == 'poi'
+            html, tier = self.tiered_html(name, view, key, facet)
+            # the tier is reported in a header
+            return html, {'Vary': 'Accept, Save-Data', 'X-Render-Quality': tier}
 
-        wraper.__name__ = source.__name__
+        wraper.__name__ = name
         return wraper
 
+    # The html of a figure degraded to the tier the load of the renderers allows, and that tier
+    def tiered_html(self, name, view, key, facet=False):
+        tier = self.load_monitor.tier()
+        if tier == 'cached':
+            html = self.cached_html(name, view, key)
+            if html is not None:
+                return html, tier
+            tier = 'fast'
+        if tier == 'fast':
+            # hourly figures switch to the pure-array heatmaps and daily ones are drawn by the browser
+            if name in self.array_metrics:
+                return self.array_view(name), tier
+            return self.client_html(view), tier
+        if tier == 'reduced' and key[1] == 'high':
+            key = (key[0], 'medium')
+        if facet and 'poi_id' in self.matrix[name].columns:
+            return self.facet_view(name, key), tier
+        return self.figure_html(name, view, key, tier), tier
+
+    # The html of a figure in a negotiated format and quality, raster figures are offered in every size
+    # variant and vector figures are embedded
+    def figure_html(self, name, view, key, tier='full'):
+        if key[0] != 'svg':
+            return self.responsive_html(name, view, key, tier)
+        variants = view['variants']
+        if key not in variants or self.failed(variants[key]):
+            variants[key] = self.render(view['function'], dict(view['payload'], format=key[0], quality=key[1]))
+        # Embed the result in the html output.
+        data = base64.b64encode(variants[key].result()).decode("ascii")
+        return f"<img src='data:{MIMETYPES[key[0]]};base64,{data}' width='1100'/>"
+
+    # The html drawing the chart specification of a view in the browser
+    def client_html(self, view):
+        return (f"<div class='eq-chart'><script type='application/json'>{view['inline']}</script></div>"
+                f"<script src='{self.static_url}/eqchart.js' defer></script>")
+
+    # The img tag of a raster figure offering every size variant through srcset, the reduced tier
+    # leaves out the variants wider than the desktop one
+    def responsive_html(self, name, view, key, tier='full', widths=None):
+        fmt, quality = key
+        if widths is None:
+            widths = [width for width in SIZES.values() if tier == 'full' or width <= SIZES['desktop']]
+        urls = dict((width, f"{self.figure_url}/{name}/{width}.{fmt}?quality={quality}&amp;v={view['version']}")
+                    for width in sorted(widths))
+        srcset = ", ".join(f"{url} {width}w" for width, url in urls.items())
+        src = urls.get(SIZES['desktop'], urls[max(urls)])
+        return (f"<img src='{src}' srcset='{srcset}' "
+                f"sizes='(max-width: 1100px) 100vw, 1100px' width='1100' style='max-width:100%;height:auto'/>")
+
+    # The html of the images of a view that are already encoded, None when nothing has been encoded yet.
+    # Prefers the negotiated format and falls back to any other one
+    def cached_html(self, name, view, key):
+        if key in view['variants'] and view['variants'][key].done() and not self.failed(view['variants'][key]):
+            data = base64.b64encode(view['variants'][key].result()).decode("ascii")
+            return f"<img src='data:{MIMETYPES[key[0]]};base64,{data}' width='1100'/>"
+        sized = sorted(view['sized'], key=lambda k: (k[1:] != key, k[1] != key[0]))
+        if not sized:
+            return None
+        fmt, quality = sized[0][1:]
+        widths = [k[0] for k in sized if k[1:] == (fmt, quality)]
+        return self.responsive_html(name, view, (fmt, quality), widths=widths)
+
+    # The encoded bytes of a size variant of a figure, or the name of its artifact when there is an
+    # artifact store. None when the figure or the variant does not exist
+    def sized_image(self, name, width, fmt, quality):
+        view = self.views.get(name)
+        if view is None or width not in SIZES.values() or fmt not in MIMETYPES or fmt == 'svg':
+            return None
+        key = (width, fmt, quality)
+        if key not in view['sized']:
+            if self.artifact_store is None:
+                view['sized'][key] = resize_image(self.master(name).result(), width, fmt, quality)
+            else:
+                # another worker of the node may have encoded this variant already
+                ref = f"{name}/{RENDER_VERSION}/{view['version']}/{width}/{fmt}/{quality}"
+                artifact = self.artifact_store.lookup(ref)
+                if artifact is None:
+                    artifact = self.artifact_store.put(resize_image(self.master(name).result(), width, fmt, quality),
+                                                       fmt, ref=ref)
+                view['sized'][key] = artifact
+        return view['sized'][key]
+
+    # The response serving a size variant of a figure, straight from its file when there is an artifact store.
+    # Only the url carrying the current version of the figure is cached for good
+    def sized_response(self, name, width, fmt, quality, version=None):
+        image = self.sized_image(name, width, fmt, quality)
+        if image is None:
+            return None
+        max_age = None if version == self.views[name]['version'] else 300
+        if self.artifact_store is not None:
+            response = self.artifact_store.send(image, max_age)
+            if response is None:
+                # the artifact has been pruned from the store, the variant is encoded again
+                self.views[name]['sized'].pop((width, fmt, quality), None)
+                response = self.artifact_store.send(self.sized_image(name, width, fmt, quality), max_age)
+            return response
+        return image, {'Content-Type': MIMETYPES[fmt], 'Cache-Control': f'public, max-age={max_age or 86400}'}
+
+    # Rebuild the payload of a figure view from the current data, the variants are rendered again unless
+    # the figure draws the same thing as before
+    def refresh_view(self, name):
+        with self.source_lock(name):
+            view = dict(self.views[name])
+            payload = view['payload_function'](name)
+            spec = json.dumps(view['spec_function'](payload), separators=(',', ':'))
+            # the version in the image urls changes with the data so that browsers fetch the new images
+            version = hashlib.sha1(spec.encode()).hexdigest()[:12]
+            if view.get('version') == version:
+                return
+            view['payload'] = payload
+            # render the high resolution master right away so that all the figures render concurrently,
+            # the raster variants are downscaled from it and the vector ones rendered on demand
+            view['master'] = self.render(view['function'], dict(payload, format='png', width=max(SIZES.values())))
+            view['sized'] = dict()
+            view['variants'] = dict()
+            view['spec'] = spec
+            # the specification is inlined in a json script block that the renderer reads
+            view['inline'] = spec.replace('</', '<\\/')
+            view['version'] = version
+            # the specification is also kept as a precompressed json artifact
+            view['spec_artifact'] = None
+            if self.artifact_store is not None:
+                view['spec_artifact'] = self.artifact_store.put(view['spec'], 'json', compress=True)
+            # swap the whole view so that requests never see a half refreshed one
+            self.views[name] = view
+
+    # This method should plot the data obtained under "daily" route
+    def daily_data_plot(self, source):
+        # line charts are far smaller as vector graphics
+        return self.figure_view(source.__name__, render_daily, self.daily_payload, ['svg', 'webp', 'png'], daily_spec)
+
+
+    def hour_data_plot(self, source):  # This method serves to plot all the hour-based data, and plot them in heatmap
+        return self.figure_view(source.__name__, render_hourly, self.hourly_payload, ['webp', 'png'], hourly_spec)
+
 
 # The class for geographic data visualization which inherits DataVisualization class
 class GeoVisualization(DataVisualization):
 
-    # Define the function to implement plot
-    def geo_plot(self, source_poi, intersted_data):
-        df_poi = self.matrix[source_poi.__name__]
-        df_interested_data = self.matrix[intersted_data.__name__]
+    def __init__(self, render_pool=None, artifact_store=None):
+        DataVisualization.__init__(self, render_pool, artifact_store)
+        self.plotlyjs = None
+        # the frames of the lazily loaded maps keyed by version and date, as artifact names or as json bodies
+        # without a store. The least recently used maps are dropped first, except the map of every poi whose
+        # version is frames_version
+        self.frames = OrderedDict()
+        self.frames_version = None
+        self.frames_cache_size = 32
+        self.frames_lock = threading.Lock()
+        # the spatial indexes of the sources with coordinates, keyed by source
+        self.indexes = dict()
+        # the zoom cluster indexes of the pois with the metrics of a source, keyed by the pair of sources
+        self.cluster_indexes = dict()
+        # the rows of the sources joined with their pois, keyed by the pair of sources
+        self.joins = dict()
+        # beyond this many markers the maps draw the density of the pois, from at most density_points clusters
+        self.density_threshold = 5000
+        self.density_points = 4000
+        # the prefix of the route serving the frames
+        self.frames_url = '/poi/frames'
+
+    # The src of the plotly.js bundle. It is written to the artifact store once per plotly version and its
+    # content-addressed name lets the browsers cache it for good, without a store it is inlined in every map
+    def plotlyjs_src(self):
+        if self.artifact_store is None:
+            return True
+        if self.plotlyjs is None:
+            ref = f"plotly.js/{plotly.__version__}"
+            name = self.artifact_store.lookup(ref)
+            if name is None:
+                name = self.artifact_store.put(opy.get_plotlyjs(), 'js', ref=ref, compress=True)
+            self.plotlyjs = f"{self.artifact_url}/{name}"
+        return self.plotlyjs
+
+    # Index the coordinates of the sources that have some as soon as they are loaded
+    def load_response(self, name, response):
+        with self.source_lock(name):
+            DataVisualization.load_response(self, name, response)
+            df = self.matrix[name]
+            if 'lat' in df.columns and 'lon' in df.columns:
+                self.indexes[name] = GridIndex(df['lat'].values, df['lon'].values)
+
+    # The positions of the rows of a source inside a bounding box of minLon, minLat, maxLon, maxLat
+    def within_bbox(self, name, bbox):
+        return self.indexes[name].query(*bbox)
+
+    # The k rows of a source closest to a point with their distance_km, from the closest one
+    def nearest(self, name, lat, lon, k):
+        positions, distances = self.indexes[name].nearest(lat, lon, k)
+        return self.matrix[name].iloc[positions].assign(distance_km=distances)
+
+    # The rows of a source within radius_km of a point with their distance_km, from the closest one
+    def within_radius(self, name, lat, lon, radius_km):
+        positions, distances = self.indexes[name].within(lat, lon, radius_km)
+        return self.matrix[name].iloc[positions].assign(distance_km=distances)
+
+    # The zoom cluster index of the pois of a source, weighted by the sums of the metrics of another source
+    # over every poi. It is built again when either source is loaded again
+    def cluster_index(self, name_poi, name_data):
+        df_poi, df_data = self.matrix[name_poi], self.matrix[name_data]
+        cached = self.cluster_indexes.get((name_poi, name_data))
+        if cached is not None and cached['poi'] is df_poi and cached['data'] is df_data:
+            return cached
+        metrics = [c for c in df_data.select_dtypes('number').columns if c not in ('poi_id', 'hour')]
+        sums = df_data.groupby('poi_id')[metrics].sum().reindex(df_poi['poi_id']).fillna(0)
+        index = ClusterIndex(df_poi['lat'].values, df_poi['lon'].values, dict((c, sums[c].values) for c in metrics))
+        cached = {'poi': df_poi, 'data': df_data, 'metrics': metrics, 'index': index}
+        # the vector tiles draw the clusters of their zoom
+        cached['tiles'] = VectorTileSet(name_poi, lambda zoom, bbox: self.cluster_features(cached, zoom, bbox))
+        self.cluster_indexes[(name_poi, name_data)] = cached
+        return cached
+
+    # The clusters of pois drawn at a zoom, inside a bounding box when there is one. A cluster of a single
+    # poi carries its poi_id and its name
+    def poi_clusters(self, name_poi, name_data, zoom, bbox=None):
+        return self.cluster_frame(self.cluster_index(name_poi, name_data), zoom, bbox)
+
+    # The gzipped vector tile of the clusters of pois, None when the tile is outside the world
+    def poi_tile(self, name_poi, name_data, z, x, y):
+        return self.cluster_index(name_poi, name_data)['tiles'].tile(z, x, y)
+
+    def cluster_features(self, cached, zoom, bbox):
+        df = self.cluster_frame(cached, zoom, bbox)
+        return df['lat'].values, df['lon'].values, df.drop(columns=['lat', 'lon']).to_dict(orient='records')
+
+    def cluster_frame(self, cached, zoom, bbox=None):
+        level, positions = cached['index'].clusters(zoom, bbox)
+        df = pd.DataFrame({'lat': level['lat'][positions], 'lon': level['lon'][positions],
+                           'count': level['count'][positions].astype(int)})
+        for metric in cached['metrics']:
+            df[metric] = level['sums'][metric][positions]
+        # a single poi stays where it is instead of at the projected centroid
+        single = (df['count'] == 1).values
+        pois = cached['poi'].iloc[level['point'][positions][single]]
+        df.loc[single, 'lat'] = pois['lat'].values
+        df.loc[single, 'lon'] = pois['lon'].values
+        for column in ('poi_id', 'name'):
+            if column in pois.columns:
+                values = iter(pois[column].tolist())
+                df[column] = pd.Series([next(values) if one else None for one in single], dtype=object)
+        return df
+
+    # The rows of a source joined with their pois like a merge on poi_id. The pois are a lookup indexed by
+    # poi_id so that the join is a take by position, and the poi_id, name and date of the join are categorical.
+    # The join is kept until either source is loaded again
+    def poi_join(self, name_poi, name_data):
+        df_poi, df_data = self.matrix[name_poi], self.matrix[name_data]
+        cached = self.joins.get((name_poi, name_data))
+        if cached is not None and cached['poi'] is df_poi and cached['data'] is df_data:
+            return cached['join']
+        pois = df_poi.drop_duplicates('poi_id').reset_index(drop=True)
+        positions = pd.Index(pois['poi_id']).get_indexer(df_data['poi_id'])
+        rows = positions >= 0
+        positions = positions[rows]
+        join = df_data[rows].reset_index(drop=True)
+        # the codes of the poi_id are the positions of the pois
+        join['poi_id'] = pd.Categorical.from_codes(positions, categories=pois['poi_id'])
+        # the columns both sources have are told apart like merge does
+        overlap = [c for c in pois.columns if c != 'poi_id' and c in df_data.columns]
+        join = join.rename(columns=dict((c, c + '_x') for c in overlap))
+        for column in pois.columns:
+            if column == 'name':
+                # the names are factorized over the pois, not over the rows
+                codes, names = pd.factorize(pois[column])
+                values = pd.Categorical.from_codes(codes[positions], categories=names)
+            elif column != 'poi_id':
+                values = pois[column].values.take(positions)
+            if column != 'poi_id':
+                join[column + '_y' if column in overlap else column] = values
+        if 'date' in join.columns:
+            codes, dates = pd.factorize(join['date'])
+            join['date'] = pd.Categorical.from_codes(codes, categories=dates)
+        self.joins[(name_poi, name_data)] = {'poi': df_poi, 'data': df_data, 'join': join}
+        return join
+
+    # Define the function to implement plot, the map only carries the figure and loads plotly.js from plotlyjs.
+    # A lazy map only carries its first frame and fetches the others when they are shown, a bounding box
+    # limits the map to the pois inside it
+    def geo_plot(self, source_poi, intersted_data, plotlyjs=None, lazy=False, compact=False, bbox=None):
         # Joining the POI data with the data of interest
-        df = df_interested_data.merge(df_poi, on='poi_id')
+        df = self.poi_join(source_poi.__name__, intersted_data.__name__)
+        if bbox is not None:
+            inside = self.matrix[source_poi.__name__]['poi_id'].values[self.within_bbox(source_poi.__name__, bbox)]
+            df = df[df['poi_id'].isin(inside)].reset_index(drop=True)
         # If there is no geo data in the data set, raises error
         if "lat" not in df.columns or "lon" not in df.columns:
             raise Exception('There are no geographic data available in the data')
+        if len(df.index) == 0:
+            return "<div class='eq-map'><p>There are no points of interest to show here</p></div>"
+        # an animated map draws the pois of one date at a time, its markers are the rows of its largest date
+        markers = df['date'].value_counts().max() if 'date' in df.columns else len(df.index)
+        if markers > self.density_threshold:
+            return self.density_map(source_poi.__name__, intersted_data.__name__, plotlyjs, bbox)
+        if lazy:
+            return self.lazy_map(df, plotlyjs, compact, pin=bbox is None)
         hover_data = {"poi_id": False, "lat": False, "lon": False}
         hover_data.update(dict((c, True) for c in df.columns if c != "poi_id" and c != "lat" and c != "lon"))
         # Construct an instance of figure
         fig = px.scatter_mapbox(df,
                                 lat="lat",
                                 lon="lon",
-                                size=[10 for _ in range(len(df.index))],
+                                size=np.full(len(df.index), 10),
                                 hover_name="name",
                                 hover_data=hover_data,
                                 color_discrete_sequence=["fuchsia"],
@@ -129,9 +828,108 @@ class GeoVisualization(DataVisualization):
         fig.update_layout(mapbox_style="open-street-map",height=600)
         fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
         #fig.write_html(r"C:\Users\Xiaokeai\Desktop\POI.html")
-        div = opy.plot(fig, auto_open=False, output_type='div')
+        div = opy.plot(fig, auto_open=False, output_type='div',
+                       include_plotlyjs=self.plotlyjs_src() if plotlyjs is None else plotlyjs)
         return div
 
+    # Split the animated map into a static layer of the pois, sent once with the map, and frames holding the
+    # position of every row in the layer and the metrics of the rows only. The map is sent with its first frame,
+    # eqmap.js fetches the other frames from frames_url and rebuilds them on the layer. A compact map packs
+    # the coordinates as fixed-point integers and every numeric array as a typed array. The frames of a pinned
+    # map are never dropped until another map is pinned
+    def lazy_map(self, df, plotlyjs=None, compact=False, pin=False):
+        # the dates end up in the urls of the frames, only the distinct dates are parsed
+        dates = df['date'].astype('category').cat.categories
+        df = df.assign(date=df['date'].astype('category').map(dict(zip(dates, pd.to_datetime(dates).strftime('%Y-%m-%d')))))
+        layer = df.drop_duplicates('poi_id')[['poi_id', 'name', 'lat', 'lon']]
+        metrics = [c for c in df.columns if c not in ('poi_id', 'name', 'lat', 'lon', 'date')]
+        positions = pd.Index(layer['poi_id']).get_indexer(df['poi_id'])
+        pack = pack_array if compact else (lambda values, scale=None: values)
+        bodies = dict()
+        for date, rows in df.groupby('date', sort=False, observed=True).indices.items():
+            bodies[date] = json.dumps({'date': date, 'poi': pack(positions[rows]),
+                                       'values': dict((c, pack(df[c].values[rows])) for c in metrics)}, cls=PlotlyJSONEncoder)
+        dates = list(bodies)
+        frames = dict()
+        for date, body in bodies.items():
+            frames[date] = body.encode('utf-8') if self.artifact_store is None else self.artifact_store.put(body, 'json', compress=True)
+        version = hashlib.sha1("".join(bodies.values()).encode('utf-8')).hexdigest()[:12]
+        with self.frames_lock:
+            self.frames[version] = frames
+            self.frames.move_to_end(version)
+            if pin:
+                self.frames_version = version
+            if len(self.frames) > self.frames_cache_size:
+                oldest = next(v for v in self.frames if v != self.frames_version)
+                del self.frames[oldest]
+        # the figure itself only draws the first frame, its hover template reads the metrics from the custom data
+        first = df[df['date'] == dates[0]]
+        fig = px.scatter_mapbox(first,
+                                lat="lat",
+                                lon="lon",
+                                size=np.full(len(first.index), 10),
+                                hover_name="name",
+                                custom_data=['date'] + metrics,
+                                color_discrete_sequence=["fuchsia"],
+                                center={'lat': layer['lat'].mean(), 'lon': layer['lon'].mean()},
+                                zoom=3,
+                                height=600)
+        hovertemplate = "<br>".join(f"{c}=%{{customdata[{i}]}}" for i, c in enumerate(['date'] + metrics))
+        fig.update_traces(hovertemplate="<b>%{hovertext}</b><br><br>" + hovertemplate + "<extra></extra>")
+        fig.update_layout(mapbox_style="open-street-map", margin={"r": 0, "t": 0, "l": 0, "b": 0})
+        div = opy.plot(fig, auto_open=False, output_type='div',
+                       include_plotlyjs=self.plotlyjs_src() if plotlyjs is None else plotlyjs)
+        config = json.dumps({'url': self.frames_url, 'version': version, 'dates': dates, 'metrics': metrics,
+                             'layer': {'name': layer['name'].tolist(),
+                                       'lat': pack(layer['lat'].values, COORDINATE_SCALE),
+                                       'lon': pack(layer['lon'].values, COORDINATE_SCALE)}}, cls=PlotlyJSONEncoder)
+        # the poi names must not close the script element
+        config = config.replace('</', '<\\/')
+        return (f"<div class='eq-map'>{div}"
+                f"<div style='display:flex;gap:8px;align-items:center;padding:8px'><button type='button'>play</button>"
+                f"<input type='range' min='0' max='{len(dates) - 1}' value='0' style='flex:1'/><output>{dates[0]}</output></div>"
+                f"<script type='application/json'>{config}</script></div>"
+                f"<script src='{self.static_url}/eqmap.js'></script>")
+
+    # Draw the density of the pois instead of their markers, from the clusters of the deepest zoom that has
+    # at most density_points of them. The clusters weigh the sum of the first metric of the data, or their
+    # number of pois when it has none
+    def density_map(self, name_poi, name_data, plotlyjs=None, bbox=None):
+        cached = self.cluster_index(name_poi, name_data)
+        index = cached['index']
+        zoom = max([z for z, level in enumerate(index.levels) if len(level['count']) <= self.density_points] or [0])
+        level, positions = index.clusters(zoom) if bbox is None else index.containing(zoom, bbox)
+        if len(positions) == 0:
+            return "<div class='eq-map'><p>There are no points of interest to show here</p></div>"
+        metric = cached['metrics'][0] if cached['metrics'] else 'count'
+        weights = level['count'][positions] if metric == 'count' else level['sums'][metric][positions]
+        lat, lon = level['lat'][positions], level['lon'][positions]
+        fig = go.Figure(go.Densitymapbox(lat=lat, lon=lon, z=weights, radius=20, colorscale='Magma', hoverinfo='skip',
+                                         colorbar={'title': {'text': metric}}))
+        center = {'lat': float(np.average(lat, weights=level['count'][positions])),
+                  'lon': float(np.average(lon, weights=level['count'][positions]))}
+        fig.update_layout(mapbox_style="open-street-map", mapbox_zoom=3, mapbox_center=center, height=600,
+                          margin={"r": 0, "t": 0, "l": 0, "b": 0})
+        div = opy.plot(fig, auto_open=False, output_type='div',
+                       include_plotlyjs=self.plotlyjs_src() if plotlyjs is None else plotlyjs)
+        return div
+
+    # The response of a frame of a lazy map, the latest map without a version. None when there is no such frame
+    def frame_response(self, date, version=None):
+        # only the urls naming the version of their map are cached for good
+        requested = version
+        with self.frames_lock:
+            version = version or self.frames_version
+            frames = self.frames.get(version)
+            if frames is not None:
+                self.frames.move_to_end(version)
+        frame = None if frames is None else frames.get(date)
+        if frame is None:
+            return None
+        if self.artifact_store is not None:
+            return self.artifact_store.send(frame, max_age=None if version == requested else 300)
+        return frame, {'Content-Type': 'application/json', 'Cache-Control': 'public, max-age=86400'}
+
 
 # Demonstrate the UI components
 if __name__ == '__main__':
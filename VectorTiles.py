@@ -0,0 +1,111 @@
+import math
+import gzip
+import struct
+import threading
+from collections import OrderedDict
+import numpy as np
+from SpatialIndex import mercator, inverse_mercator
+
+# the mimetype of the mapbox vector tiles
+MVT_MIMETYPE = 'application/vnd.mapbox-vector-tile'
+
+
+# The protocol buffers encoding of the vector tiles, only what point layers need
+def varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def field(number, payload):
+    # integers are varints and everything else is length delimited
+    if isinstance(payload, int):
+        return varint(number << 3) + varint(payload)
+    return varint(number << 3 | 2) + varint(len(payload)) + payload
+
+
+def packed(values):
+    return b''.join(varint(value) for value in values)
+
+
+def encode_value(value):
+    if isinstance(value, str):
+        return field(1, value.encode('utf-8'))
+    if isinstance(value, (bool, np.bool_)):
+        return field(7, int(value))
+    if isinstance(value, (int, np.integer)):
+        return field(6, zigzag(int(value)))
+    # doubles are the only fixed width field
+    return varint(3 << 3 | 1) + struct.pack('<d', float(value))
+
+
+# Encode a layer of points, every feature is an x and a y in tile coordinates and a dict of properties.
+# The keys and the values are shared by the features of the layer
+def encode_layer(name, features, extent=4096):
+    keys, values = OrderedDict(), OrderedDict()
+    encoded = []
+    for number, (x, y, properties) in enumerate(features):
+        tags = []
+        for key, value in properties.items():
+            if value is None or (isinstance(value, float) and math.isnan(value)):
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value).__name__, value), len(values)))
+        # a single move to command
+        geometry = [1 << 3 | 1, zigzag(int(x)), zigzag(int(y))]
+        encoded.append(field(2, field(1, number + 1) + field(2, packed(tags)) + field(3, 1) + field(4, packed(geometry))))
+    layer = field(15, 2) + field(1, name.encode('utf-8')) + b''.join(encoded)
+    layer += b''.join(field(3, key.encode('utf-8')) for key in keys)
+    layer += b''.join(field(4, encode_value(value)) for _, value in values)
+    layer += field(5, extent)
+    return field(3, layer)
+
+
+class VectorTileSet(object):
+
+    # The vector tiles of one layer of points, drawn by features(z, bbox) which returns the lat, the lon and
+    # the properties of the points inside a bounding box at a zoom. The encoded tiles are kept gzipped in a
+    # least recently used cache
+    def __init__(self, name, features, extent=4096, buffer=64, cache_size=1024):
+        self.name = name
+        self.features = features
+        self.extent = extent
+        # the points this many tile units outside a tile are drawn in it too, the markers crossing its edges
+        self.buffer = buffer
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+
+    # The gzipped tile, None when the tile is outside the world
+    def tile(self, z, x, y):
+        if not 0 <= z <= 30 or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+            return None
+        with self.lock:
+            if (z, x, y) in self.cache:
+                self.cache.move_to_end((z, x, y))
+                return self.cache[(z, x, y)]
+        tile = gzip.compress(self.encode(z, x, y), 6)
+        with self.lock:
+            self.cache[(z, x, y)] = tile
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return tile
+
+    def encode(self, z, x, y):
+        size = 2 ** z
+        margin = self.buffer / self.extent
+        # the bounding box of the tile and its buffer, web mercator y runs south
+        north, west = inverse_mercator((x - margin) / size, (y - margin) / size)
+        south, east = inverse_mercator((x + 1 + margin) / size, (y + 1 + margin) / size)
+        lat, lon, properties = self.features(z, (max(west, -180.0), south, min(east, 180.0), north))
+        px, py = mercator(lat, lon)
+        px = np.round((np.asarray(px) * size - x) * self.extent)
+        py = np.round((np.asarray(py) * size - y) * self.extent)
+        return encode_layer(self.name, zip(px, py, properties), self.extent)
@@ -1,10 +1,35 @@
-from flask import Flask,jsonify
+from flask import Flask,jsonify,abort,request,Response,stream_with_context,url_for
+from flask.json.provider import DefaultJSONProvider
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+import threading
 import sqlalchemy
 from RateLimiter import RateLimiter
+from RenderPool import RenderPool
+from ArtifactStore import ArtifactStore
 from UICOMPONENTS import DataVisualization as ui
 from UICOMPONENTS import GeoVisualization as Geo
+from UICOMPONENTS import SIZES
+from ImageFormat import ALIASES, QUALITIES, negotiate
+from SpatialIndex import parse_bbox, parse_point
+from VectorTiles import MVT_MIMETYPE
+import gzip
+import decimal
+
+
+# The sums of numeric columns come back from the database as decimals, they are sent as numbers like
+# simplejson sent them before flask dropped it, not as strings
+class JSONProvider(DefaultJSONProvider):
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, decimal.Decimal):
+            return float(o)
+        return DefaultJSONProvider.default(o)
+
 
 app = Flask(__name__)
+app.json = JSONProvider(app)
 ctx = app.app_context()
 ctx.push()
 rl_index = RateLimiter(5)
@@ -13,8 +38,12 @@ rl_ed = RateLimiter(5)
 rl_sh = RateLimiter(5)
 rl_sd = RateLimiter(5)
 rl_poi = RateLimiter(5)
-figure = ui()
-geo = Geo()
+# the worker processes rendering the figures in parallel
+render_pool = RenderPool()
+# the on-disk store shared by every worker, the images and bodies are served from it with sendfile
+store = ArtifactStore()
+figure = ui(render_pool, store)
+geo = Geo(artifact_store=store)
 
 # database engine
 engine = sqlalchemy.create_engine('postgresql://readonly:w2UIO@#bg532!@work-samples-db.cx4wctygygyq.us-east-1.rds.amazonaws.com:5432/work_samples')
@@ -23,6 +52,43 @@ def queryHelper(query):
         result = conn.execute(query).fetchall()
         return jsonify([dict(row.items()) for row in result])
 
+# the queries feeding every route
+QUERIES = {
+    'events_hourly': '''
+        SELECT *
+        FROM public.hourly_events
+        ORDER BY date, hour
+        LIMIT 168;
+    ''',
+    'events_daily': '''
+        SELECT date, SUM(events) AS events
+        FROM public.hourly_events
+        GROUP BY date
+        ORDER BY date
+        LIMIT 7;
+    ''',
+    'stats_hourly': '''
+        SELECT clicks, date,hour,impressions,poi_id, CAST(revenue AS int)
+        FROM public.hourly_stats
+        ORDER BY date, hour
+        LIMIT 168;
+    ''',
+    'stats_daily': '''
+        SELECT date,
+            SUM(impressions) AS impressions,
+            SUM(clicks) AS clicks,
+            SUM(revenue) AS revenue
+        FROM public.hourly_stats
+        GROUP BY date
+        ORDER BY date
+        LIMIT 7;
+    ''',
+    'poi': '''
+        SELECT *
+        FROM public.poi;
+    ''',
+}
+
 @app.route('/')
 @rl_index.request
 def index():
@@ -30,16 +96,12 @@ def index():
 
 @app.route('/events/hourly')
 @figure.hour_data_plot
+@figure.hour_array_plot
 @geo.add_data_for_visualization
 @figure.add_data_for_visualization
 @rl_eh.request
 def events_hourly():
-    return queryHelper('''
-        SELECT *
-        FROM public.hourly_events
-        ORDER BY date, hour
-        LIMIT 168;
-    ''')
+    return queryHelper(QUERIES['events_hourly'])
 
 
 @app.route('/events/daily')
@@ -47,26 +109,58 @@ def events_hourly():
 @figure.add_data_for_visualization
 @rl_ed.request
 def events_daily():
-    return queryHelper('''
-        SELECT date, SUM(events) AS events
-        FROM public.hourly_events
-        GROUP BY date
-        ORDER BY date
-        LIMIT 7;
-    ''')
+    return queryHelper(QUERIES['events_daily'])
 
 
 @app.route('/stats/hourly')
 @figure.hour_data_plot
+@figure.hour_array_plot
 @figure.add_data_for_visualization
 @rl_sh.request
 def stats_hourly():
-    return queryHelper('''
-        SELECT clicks, date,hour,impressions,poi_id, CAST(revenue AS int)
-        FROM public.hourly_stats
-        ORDER BY date, hour
-        LIMIT 168;
-    ''')
+    return queryHelper(QUERIES['stats_hourly'])
+
+
+# the deep-zoom tiles of the hourly heatmaps, dates run along x and hours along y
+@app.route('/tiles/<metric>/<int:z>/<int:x>/<int:y>.png')
+def heatmap_tile(metric, z, x, y):
+    tile = figure.heatmap_tile(metric, z, x, y)
+    if tile is None:
+        abort(404)
+    return tile, {'Content-Type': 'image/png', 'Cache-Control': 'public, max-age=3600'}
+
+
+# the vector tiles of the pois, clustered for their zoom with the sums of their hourly events
+@app.route('/tiles/poi/<int:z>/<int:x>/<int:y>.mvt')
+def poi_tile(z, x, y):
+    tile = geo.poi_tile('poi', 'events_hourly', z, x, y)
+    if tile is None:
+        abort(404)
+    headers = {'Content-Type': MVT_MIMETYPE, 'Cache-Control': 'public, max-age=3600', 'Vary': 'Accept-Encoding'}
+    # the tiles are kept gzipped, the rare clients not accepting gzip get them inflated
+    if 'gzip' not in request.headers.get('Accept-Encoding', ''):
+        return gzip.decompress(tile), headers
+    return tile, dict(headers, **{'Content-Encoding': 'gzip'})
+
+
+# the size variants of the raster figures offered through srcset
+@app.route('/figures/<name>/<int:width>.<ext>')
+def figure_image(name, width, ext):
+    fmt = ALIASES.get(ext, ext)
+    quality = request.args.get('quality', 'high')
+    response = figure.sized_response(name, width, fmt, quality, request.args.get('v')) if quality in QUALITIES else None
+    if response is None:
+        abort(404)
+    return response
+
+
+# the content-addressed artifacts, their names never change content so they are cached for good
+@app.route('/artifacts/<name>')
+def artifact(name):
+    response = store.send(name)
+    if response is None:
+        abort(404)
+    return response
 
 
 @app.route('/stats/daily')
@@ -74,26 +168,189 @@ def stats_hourly():
 @figure.add_data_for_visualization
 @rl_sd.request
 def stats_daily():
-    return queryHelper('''
-        SELECT date,
-            SUM(impressions) AS impressions,
-            SUM(clicks) AS clicks,
-            SUM(revenue) AS revenue
-        FROM public.hourly_stats
-        GROUP BY date
-        ORDER BY date
-        LIMIT 7;
-    ''')
+    return queryHelper(QUERIES['stats_daily'])
 @geo.add_data_for_visualization
 @rl_poi.request
 def poi():
-    return queryHelper('''
-        SELECT *
-        FROM public.poi;
-    ''')
+    return queryHelper(QUERIES['poi'])
+
+# the artifact of the map of every poi and the join it was drawn from
+poi_map = {'join': None, 'artifact': None}
+poi_map_lock = threading.Lock()
+
+
+# The artifact of the map of every poi. It is drawn again when the pois or their events have been loaded
+# again, which also pins the frames of the new map, or when its artifact has been pruned from the store
+def poi_artifact():
+    with poi_map_lock:
+        join = geo.poi_join('poi', 'events_hourly')
+        if poi_map['join'] is not join or not store.touch(poi_map['artifact']):
+            fig = geo.geo_plot(poi, events_hourly, lazy=True, compact=True)
+            poi_map['artifact'] = store.put(fig, 'html', compress=True)
+            poi_map['join'] = join
+        return poi_map['artifact']
+
 
-fig = geo.geo_plot(poi, events_hourly)
+poi_artifact()
+# the map of every poi, or with a bbox of minLon,minLat,maxLon,maxLat the pois inside it and with
+# render=map the map of these pois only
 @app.route('/poi')
 def poi_func():
-    return fig
+    if 'bbox' not in request.args:
+        return store.send(poi_artifact(), max_age=300)
+    try:
+        bbox = parse_bbox(request.args['bbox'])
+    except ValueError as error:
+        abort(400, str(error))
+    if request.args.get('render') == 'map':
+        return geo.geo_plot(poi, events_hourly, lazy=True, compact=True, bbox=bbox)
+    return jsonify(geo.matrix['poi'].iloc[geo.within_bbox('poi', bbox)].to_dict(orient='records'))
+
+
+# the k pois closest to a point
+@app.route('/poi/nearest')
+def poi_nearest():
+    try:
+        lat, lon = parse_point(request.args.get('lat', ''), request.args.get('lon', ''))
+        k = int(request.args.get('k', 5))
+    except ValueError as error:
+        abort(400, str(error))
+    if k < 1:
+        abort(400, 'k must be positive')
+    return jsonify(geo.nearest('poi', lat, lon, k).to_dict(orient='records'))
+
+
+# the pois within a distance of a point
+@app.route('/poi/within')
+def poi_within():
+    try:
+        lat, lon = parse_point(request.args.get('lat', ''), request.args.get('lon', ''))
+        radius_km = float(request.args.get('radius_km', ''))
+    except ValueError as error:
+        abort(400, str(error))
+    if not radius_km >= 0:
+        abort(400, 'radius_km must not be negative')
+    return jsonify(geo.within_radius('poi', lat, lon, radius_km).to_dict(orient='records'))
+
+
+# the clusters of pois drawn at a zoom level with the sums of their hourly events, within a bbox when given
+@app.route('/poi/clusters')
+def poi_clusters():
+    try:
+        zoom = int(request.args.get('zoom', 0))
+        bbox = parse_bbox(request.args['bbox']) if 'bbox' in request.args else None
+    except ValueError as error:
+        abort(400, str(error))
+    return jsonify(geo.poi_clusters('poi', 'events_hourly', zoom, bbox).to_dict(orient='records'))
+
+
+# the frames of the animated poi map, the map fetches them when they are shown
+@app.route('/poi/frames/<date>')
+def poi_frame(date):
+    response = geo.frame_response(date, request.args.get('v'))
+    if response is None:
+        abort(404)
+    return response
+
+
+# the thread pools fetching the data of the dashboard over the connection pool and assembling its sections
+fetch_pool = ThreadPoolExecutor(max_workers=len(QUERIES))
+section_pool = ThreadPoolExecutor(max_workers=len(QUERIES))
+
+
+def fetchHelper(query):
+    with app.app_context():
+        return queryHelper(query)
+
+
+# Load the fresh data of a figure and wait for its render, the figure is degraded like its own route
+# when the renderers are busy
+def figureSection(name, fetched, key):
+    figure.load_response(name, fetched[name].result())
+    view = figure.views[name]
+    html, tier = figure.tiered_html(name, view, key)
+    if tier in ('full', 'reduced'):
+        figure.master(name).result()
+    return html
+
+
+def poiSection(fetched):
+    geo.load_response('poi', fetched['poi'].result())
+    geo.load_response('events_hourly', fetched['events_hourly'].result())
+    return geo.geo_plot(poi, events_hourly, lazy=True, compact=True)
+
+
+# The whole dashboard in one page. Every query runs at once, every figure renders as soon as its data
+# arrives, and every section is streamed as soon as it is ready, in the order it gets ready
+@app.route('/dashboard')
+def dashboard():
+    fetched = dict((name, fetch_pool.submit(fetchHelper, query)) for name, query in QUERIES.items())
+    names = [name for name in QUERIES if name in figure.views]
+    sections = dict((section_pool.submit(figureSection, name, fetched, negotiate(request, figure.views[name]['preferred'])), name)
+                    for name in names)
+    sections[section_pool.submit(poiSection, fetched)] = 'poi'
+    order = names + ['poi']
+
+    def generate():
+        yield ("<!DOCTYPE html><html><head><meta charset='utf-8'><title>EQ Works dashboard</title></head>"
+               "<body><main style='display:flex;flex-direction:column'>")
+        for future in as_completed(sections):
+            name = sections[future]
+            try:
+                html = future.result()
+            except Exception:
+                app.logger.exception('the %s section of the dashboard failed', name)
+                html = '<p>this section is not available right now</p>'
+            # the css order keeps the layout stable whatever order the sections arrive in
+            yield f"<section style='order:{order.index(name)}'><h2>{name.replace('_', ' ')}</h2>{html}</section>"
+        yield "</main></body></html>"
+
+    return Response(stream_with_context(generate()), mimetype='text/html')
+
+
+# set once the worker is warm, until then the readiness probe keeps the traffic away. A warm up that fails is
+# logged and kept in warm_up_error, and the worker takes the traffic cold rather than never
+ready = threading.Event()
+warm_up_error = None
+
+
+@app.route('/ready')
+def readiness():
+    if not ready.is_set():
+        return 'warming up', 503
+    return 'ready'
+
+
+# Pay every cold start cost before the worker takes traffic: the render workers load their libraries and
+# fonts and dry-run a render, the connection pool opens its connections, and every page is requested once
+# so that the figures, their size variants and the tiles are rendered and encoded. Every master render is
+# waited for, the size variants found in the artifact store do not wait for it
+def warm_up():
+    global warm_up_error
+    started = time.time()
+    try:
+        render_pool.wait_until_warm()
+        connections = [engine.connect() for _ in range(engine.pool.size())]
+        for connection in connections:
+            connection.close()
+        with app.test_client() as client:
+            for name, view in figure.views.items():
+                with app.test_request_context():
+                    path = url_for(name)
+                client.get(path)
+                fmt = next(f for f in view['preferred'] if f != 'svg')
+                client.get(f"/figures/{name}/{SIZES['desktop']}.{fmt}")
+            for metric in figure.tiles:
+                client.get(f"/tiles/{metric}/0/0/0.png")
+            client.get('/poi')
+        for name in figure.views:
+            figure.master(name).result()
+        app.logger.info('worker warm in %.1fs', time.time() - started)
+    except Exception as error:
+        warm_up_error = error
+        app.logger.exception('the warm up of the worker failed after %.1fs', time.time() - started)
+    ready.set()
+
 
+# the worker serves the readiness probe while it warms up
+threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
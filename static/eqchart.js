@@ -0,0 +1,106 @@
+// Draws the chart specifications sent by the figure views with ?render=client
+(function () {
+  'use strict';
+
+  function extent(values) {
+    var min = Infinity, max = -Infinity;
+    for (var i = 0; i < values.length; i++) {
+      if (values[i] === null) continue;
+      if (values[i] < min) min = values[i];
+      if (values[i] > max) max = values[i];
+    }
+    return max > min ? [min, max] : [min - 1, min + 1];
+  }
+
+  // the color of a value on a colorscale given as a list of evenly spaced stops
+  function colorOf(scale, value, min, max) {
+    var t = max > min ? (value - min) / (max - min) : 0;
+    return scale[Math.max(0, Math.min(scale.length - 1, Math.round(t * (scale.length - 1))))];
+  }
+
+  function drawLines(ctx, spec) {
+    var panelWidth = spec.width / spec.series.length;
+    spec.series.forEach(function (series, s) {
+      var xs = series.x, xRange = extent(xs);
+      var left = s * panelWidth + 60, top = 40;
+      var width = panelWidth - 80, height = spec.height - 90;
+      var yRange = extent(series.values);
+      ctx.fillStyle = '#000';
+      ctx.textAlign = 'center';
+      ctx.fillText(series.name, left + width / 2, top - 12);
+      ctx.fillText(spec.x.label, left + width / 2, top + height + 30);
+      ctx.strokeStyle = '#000';
+      ctx.strokeRect(left, top, width, height);
+      ctx.textAlign = 'right';
+      ctx.fillText(String(yRange[1]), left - 4, top + 4);
+      ctx.fillText(String(yRange[0]), left - 4, top + height);
+      ctx.strokeStyle = '#1f77b4';
+      ctx.beginPath();
+      var started = false;
+      for (var i = 0; i < xs.length; i++) {
+        if (series.values[i] === null) { started = false; continue; }
+        var x = left + (xs[i] - xRange[0]) / (xRange[1] - xRange[0]) * width;
+        var y = top + height - (series.values[i] - yRange[0]) / (yRange[1] - yRange[0]) * height;
+        if (started) ctx.lineTo(x, y); else ctx.moveTo(x, y);
+        started = true;
+      }
+      ctx.stroke();
+    });
+  }
+
+  function drawHeatmap(ctx, spec) {
+    var rows = spec.rows.values;
+    var panelHeight = spec.height / spec.panels.length;
+    var left = 220, right = 80;
+    spec.panels.forEach(function (panel, p) {
+      var top = p * panelHeight + 24, height = panelHeight - 48;
+      var width = spec.width - left - right;
+      var columns = panel.columns.length;
+      var cellWidth = width / columns, cellHeight = height / rows.length;
+      for (var r = 0; r < rows.length; r++) {
+        for (var c = 0; c < columns; c++) {
+          var value = panel.values[r * columns + c];
+          if (value === null) continue;
+          ctx.fillStyle = colorOf(spec.colorscale, value, panel.min, panel.max);
+          ctx.fillRect(left + c * cellWidth, top + r * cellHeight, Math.ceil(cellWidth), Math.ceil(cellHeight));
+        }
+      }
+      ctx.fillStyle = '#000';
+      ctx.textAlign = 'center';
+      ctx.fillText(panel.name, left + width / 2, top - 8);
+      var step = Math.max(1, Math.ceil(columns * 20 / width));
+      for (c = 0; c < columns; c += step) {
+        ctx.fillText(String(panel.columns[c]), left + (c + 0.5) * cellWidth, top + height + 14);
+      }
+      ctx.textAlign = 'right';
+      step = Math.max(1, Math.ceil(rows.length * 14 / height));
+      for (r = 0; r < rows.length; r += step) {
+        ctx.fillText(String(rows[r]), left - 6, top + (r + 0.5) * cellHeight + 4);
+      }
+      // the color bar with its range
+      for (var i = 0; i < spec.colorscale.length; i++) {
+        ctx.fillStyle = spec.colorscale[spec.colorscale.length - 1 - i];
+        ctx.fillRect(spec.width - right + 20, top + i * height / spec.colorscale.length, 16, Math.ceil(height / spec.colorscale.length));
+      }
+      ctx.fillStyle = '#000';
+      ctx.textAlign = 'left';
+      ctx.fillText(String(panel.max), spec.width - right + 40, top + 8);
+      ctx.fillText(String(panel.min), spec.width - right + 40, top + height);
+    });
+  }
+
+  function draw(container) {
+    var spec = JSON.parse(container.querySelector('script[type="application/json"]').textContent);
+    var canvas = document.createElement('canvas');
+    canvas.width = spec.width;
+    canvas.height = spec.height;
+    canvas.style.maxWidth = '100%';
+    container.appendChild(canvas);
+    var ctx = canvas.getContext('2d');
+    ctx.font = '11px sans-serif';
+    (spec.type === 'line' ? drawLines : drawHeatmap)(ctx, spec);
+  }
+
+  window.eqChart = {draw: draw};
+  Array.prototype.forEach.call(document.querySelectorAll('.eq-chart'), draw);
+})();
@@ -0,0 +1,99 @@
+// Plays the animated poi maps sent with their first frame only, the other frames are fetched when shown.
+// A frame only holds the position of its rows in the poi layer of the map and their metrics
+(function () {
+  'use strict';
+
+  var TYPED_ARRAYS = {int8: Int8Array, int16: Int16Array, int32: Int32Array, float64: Float64Array};
+
+  // Read an array packed by pack_array as a typed array, fixed-point values are scaled back and plain
+  // lists are returned as they are
+  function unpack(array) {
+    if (array === null || Array.isArray(array) || typeof array !== 'object') return array;
+    var bytes = Uint8Array.from(atob(array.data), function (c) { return c.charCodeAt(0); });
+    var values = new TYPED_ARRAYS[array.dtype](bytes.buffer);
+    if (array.scale === undefined) return values;
+    var scaled = new Float64Array(values.length);
+    for (var i = 0; i < values.length; i++) scaled[i] = values[i] / array.scale;
+    return scaled;
+  }
+
+  function lazy(container) {
+    var config = JSON.parse(container.querySelector('script[type="application/json"]').textContent);
+    config.layer.lat = unpack(config.layer.lat);
+    config.layer.lon = unpack(config.layer.lon);
+    var gd = container.querySelector('.plotly-graph-div');
+    var slider = container.querySelector('input[type="range"]');
+    var label = container.querySelector('output');
+    var button = container.querySelector('button');
+    // the promises of the rebuilt frames keyed by date, a failed fetch is dropped to be tried again
+    var frames = {};
+    var timer = null;
+
+    function load(date) {
+      if (!(date in frames)) {
+        frames[date] = fetch(config.url + '/' + encodeURIComponent(date) + '?v=' + config.version)
+          .then(function (response) {
+            if (!response.ok) throw new Error(response.statusText);
+            return response.json();
+          })
+          .then(rebuild);
+        frames[date].catch(function () { delete frames[date]; });
+      }
+      return frames[date];
+    }
+
+    // the trace of a frame, every row takes its place and name from the layer and its metrics from the frame
+    function rebuild(frame) {
+      var layer = config.layer;
+      frame.poi = unpack(frame.poi);
+      config.metrics.forEach(function (m) { frame.values[m] = unpack(frame.values[m]); });
+      var trace = {lat: [], lon: [], hovertext: [], customdata: [], size: []};
+      for (var i = 0; i < frame.poi.length; i++) {
+        var p = frame.poi[i];
+        trace.lat.push(layer.lat[p]);
+        trace.lon.push(layer.lon[p]);
+        trace.hovertext.push(layer.name[p]);
+        trace.customdata.push([frame.date].concat(config.metrics.map(function (m) { return frame.values[m][i]; })));
+        trace.size.push(10);
+      }
+      return trace;
+    }
+
+    function show(index) {
+      var date = config.dates[index];
+      label.textContent = date;
+      // fetch the next frame while this one is drawn
+      if (index + 1 < config.dates.length) load(config.dates[index + 1]);
+      return load(date).then(function (trace) {
+        // a later frame has been asked for in the meantime
+        if (Number(slider.value) !== index) return;
+        return Plotly.restyle(gd, {lat: [trace.lat], lon: [trace.lon], hovertext: [trace.hovertext],
+          customdata: [trace.customdata], 'marker.size': [trace.size]}, [0]);
+      });
+    }
+
+    function stop() {
+      clearTimeout(timer);
+      timer = null;
+      button.textContent = 'play';
+    }
+
+    function step() {
+      var index = (Number(slider.value) + 1) % config.dates.length;
+      slider.value = index;
+      show(index).then(function () {
+        if (timer !== null) timer = setTimeout(step, 500);
+      }, stop);
+    }
+
+    slider.addEventListener('input', function () { show(Number(slider.value)); });
+    button.addEventListener('click', function () {
+      if (timer !== null) return stop();
+      button.textContent = 'pause';
+      timer = setTimeout(step, 0);
+    });
+  }
+
+  window.eqMap = {lazy: lazy};
+  Array.prototype.forEach.call(document.querySelectorAll('.eq-map'), lazy);
+})();